@@ -3,6 +3,7 @@
 @Time: 2020/4/20 22:23
 @Author: Sue Zhu
 """
+from ..database.calendar_ import get_calendar
 
 
 class DataProxy(object):
@@ -11,7 +12,10 @@ class DataProxy(object):
         pass
 
     def get_date_offset(self, base, freq='D', n=0, backward=True):
-        pass
+        """
+        以不晚于 `base` 的最后一个交易日为基准, 偏移 `n` 个 `freq` 交易日, `backward` 为True时向前
+        """
+        return get_calendar().offset(base, -n if backward else n, freq)
 
     def get_all_instrument(self, asset, valid_dt, fields=None):
         pass
@@ -3,7 +3,7 @@
 @Time: 2020/5/28 10:53
 @Author: Sue Zhu
 """
-__all__ = ['get_data_config']
+__all__ = ['get_data_config', 'get_option', 'get_local_path']
 
 import configparser
 from pathlib import Path
@@ -18,3 +18,28 @@ def get_data_config(section):
     config = configparser.ConfigParser()
     config.read(Path.home().joinpath('parameciums.conf'))
     return config[section]
+
+
+def get_option(section, option, fallback=None):
+    """
+    单个配置项, 配置文件或section中没有该项时返回 `fallback`
+    :param section: str
+    :param option: str
+    :param fallback: default value
+    :return: str
+    """
+    config = configparser.ConfigParser()
+    config.read(Path.home().joinpath('parameciums.conf'))
+    return config.get(section, option, fallback=fallback)
+
+
+def get_local_path(*parts):
+    """
+    本地数据目录, 根目录由配置文件 `[local_store]` 中的 `path` 指定, 默认 `~/.paramecium`
+    :param parts: sub directories or file name
+    :return: Path
+    """
+    config = configparser.ConfigParser()
+    config.read(Path.home().joinpath('parameciums.conf'))
+    root = config.get('local_store', 'path', fallback=str(Path.home().joinpath('.paramecium')))
+    return Path(root).expanduser().joinpath(*parts)
@@ -4,20 +4,35 @@
 @Author: Sue Zhu
 """
 __all__ = [
-    'get_dates', 'get_last_td',
-    'get_risk_free_rates',
-    'get_price', 'get_sector',
+    'get_dates', 'get_last_td', 'TradingCalendar', 'get_calendar',
+    'get_risk_free_rates', 'rf_at',
+    'get_price', 'iter_price', 'get_sector', 'get_panel', 'get_return_panel',
+    'IntervalIndex', 'get_sector_index', 'get_name_index', 'refresh_membership',
     'get_index_bond5', 'get_index_ff3', 'calc_market_factor', 'calc_timing_factor',
     'StockUniverse', 'get_derivative_indicator',
     'FundUniverse',
-    'FactorDBTool', 'add_factor_to_monitor',
+    'FactorDBTool', 'ParquetFactorIO', 'get_factor_io', 'export_factor_table', 'add_factor_to_monitor',
+    'configure_engine', 'clear_memo', 'enable_query_stats', 'disable_query_stats', 'query_scope', 'query_stats', 'query_report',
     'BaseJob', 'SimpleServer'
 ]
 
+from ._memo import clear_memo
+from ._postgres import configure_engine
+from ._query_stats import enable_query_stats, disable_query_stats, query_scope, query_stats, query_report
 from ._tool import flat_1dim
-from .comment import get_risk_free_rates, get_dates, get_last_td, get_price, get_sector
-from .factor_io import FactorDBTool, add_factor_to_monitor
+from .calendar_ import TradingCalendar, get_calendar
+from .comment import get_risk_free_rates, rf_at, get_dates, get_last_td, get_price, iter_price, get_sector
+from .factor_io import FactorDBTool, ParquetFactorIO, get_factor_io, export_factor_table, add_factor_to_monitor
 from .fund_ import FundUniverse
+from .membership import IntervalIndex, get_sector_index, get_name_index, refresh_membership
+from .panel import get_panel, get_return_panel
 from .index_ import get_index_bond5, get_index_ff3, calc_market_factor, calc_timing_factor
-from .scheduler import BaseJob, SimpleServer
 from .stock_ import StockUniverse, get_derivative_indicator
+
+
+def __getattr__(name):
+    # scheduler depends on `ndscheduler`, import it only when used.
+    if name in ('BaseJob', 'SimpleServer'):
+        from . import scheduler
+        return getattr(scheduler, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
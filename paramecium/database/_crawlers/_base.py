@@ -5,9 +5,10 @@
 """
 __all__ = ['CrawlerJob', 'get_wind_conf', 'get_session', 'get_type_codes']
 
+from functools import lru_cache
+
 import numpy as np
 import pandas as pd
-from WindPy import w
 from requests import request
 
 from .._postgres import get_session
@@ -15,9 +16,15 @@ from .._third_party_api import get_tushare_data, WindDataError, get_wind_conf
 from .._tool import get_type_codes
 from ..scheduler import BaseJob
 
-w.start()  # 默认命令超时时间为120秒，如需设置超时时间可以加入waitTime参数
-if not w.isconnected():  # 判断WindPy是否已经登录成功
-    raise WindDataError("Wind API fail to be connected.")
+
+@lru_cache(maxsize=1)
+def _wind_api():
+    """ start WindPy at the first query, so loading crawlers does not need a wind terminal """
+    from WindPy import w
+    w.start()  # 默认命令超时时间为120秒，如需设置超时时间可以加入waitTime参数
+    if not w.isconnected():  # 判断WindPy是否已经登录成功
+        raise WindDataError("Wind API fail to be connected.")
+    return w
 
 
 class CrawlerJob(BaseJob):
@@ -38,7 +45,7 @@ class CrawlerJob(BaseJob):
         if 'fields' in func_kwargs.keys():
             func_kwargs['fields'] = ','.join(func_kwargs['fields']).lower()
 
-        api = getattr(w, api_name)
+        api = getattr(_wind_api(), api_name)
         error, data = api(**func_kwargs, usedf=True)
         if error:
             raise WindDataError(f'Wind Data Api Error with {error}')
@@ -12,6 +12,7 @@ from pandas.tseries.offsets import QuarterEnd
 
 from ._base import *
 from ..comment import get_last_td
+from ..membership import refresh_membership
 from ..pg_models import fund, others
 from ... import utils
 
@@ -183,7 +184,8 @@ class FundNav(CrawlerJob):
                 nav = self.insert_nav(nav, i / max_dts.shape[0])
 
         self.insert_nav(nav, 1)
-        self.clean_duplicates(fund.Nav, [fund.Nav.wind_code, fund.Nav.trade_dt])
+        self.clean_duplicates(
+            fund.Nav, [fund.Nav.wind_code, fund.Nav.trade_dt], start=max_dts.min() if max_dts.size else None)
 
     def insert_nav(self, nav, pct):
         nav['adj_factor'] = nav['adj_nav'].div(nav['unit_nav']).round(6)
@@ -240,6 +242,7 @@ class FundSector(CrawlerJob):
                 self.get_logger().error('sector data may not localized entirely.')
             ts_data = ts_data.loc[(ts_data['entry_dt'] >= t) | (ts_data['remove_dt'] >= t)]
             self.insert_data(ts_data, model, ukeys=model.uk_.columns)
+        refresh_membership()
 
 
 class FundPortfolioAsset(CrawlerJob):
@@ -9,6 +9,8 @@ import pandas as pd
 from bs4 import BeautifulSoup
 
 from ._base import *
+from ..calendar_ import get_calendar
+from ..comment import invalidate_rate_curves
 from ..pg_models import others
 from ...utils.date_tool import expand_calendar
 
@@ -40,6 +42,7 @@ class CalendarCrawler(CrawlerJob):
         cal_df.index.name = 'trade_dt'
 
         self.insert_data(records=cal_df.reset_index(), model=model, ukeys=model.get_primary_key())
+        get_calendar.cache_clear()
 
 
 class IndustryCode(CrawlerJob):
@@ -73,6 +76,7 @@ class RateBaselineCrawler(CrawlerJob):
             index=['change_dt', 'loan_rate', 'save_rate'],
         ).T.astype({'loan_rate': float, 'save_rate': float})
         self.insert_data(data, others.InterestRate, others.InterestRate.get_primary_key())
+        invalidate_rate_curves()
 
     @staticmethod
     def html2list(html_series):
@@ -9,7 +9,9 @@ import pandas as pd
 import sqlalchemy as sa
 
 from ._base import *
-from ..comment import get_last_td, get_dates
+from ..calendar_ import get_calendar
+from ..comment import get_last_td
+from ..membership import refresh_membership
 from ..pg_models import stock, others
 from ... import const
 
@@ -47,6 +49,7 @@ class ASharePreviousName(CrawlerJob):
             ts_data['change_reason'] = ts_data['change_reason'].dropna().map(lambda x: f'{x:.0f}')
             ts_data = ts_data.fillna({'remove_dt': pd.Timestamp.max})
             self.insert_data(ts_data, stock.ASharePreviousName, stock.ASharePreviousName.uk_.columns)
+        refresh_membership()
 
 
 class _CrawlerEOD(CrawlerJob):
@@ -66,7 +69,7 @@ class _CrawlerEOD(CrawlerJob):
             if max_dt is pd.NaT:
                 max_dt = pd.Timestamp('1990-01-01')
 
-        trade_dates = [i for i in get_dates('D') if max_dt < i <= get_last_td()]
+        trade_dates = get_calendar().range(max_dt + pd.Timedelta(days=1), get_last_td())
         price = pd.DataFrame()
         for i, dt in enumerate(trade_dates):
             # in case of data limit out.
@@ -81,7 +84,7 @@ class _CrawlerEOD(CrawlerJob):
                 price = pd.DataFrame()
 
         self.insert_data(records=price, model=self.model, msg='100%')
-        self.clean_duplicates(self.model, [self.model.wind_code, self.model.trade_dt])
+        self.clean_duplicates(self.model, [self.model.wind_code, self.model.trade_dt], start=max_dt)
 
 
 class ASharePrice(_CrawlerEOD):
@@ -149,7 +152,7 @@ class AShareSuspend(CrawlerJob):
                 # data exist, download by date
                 query_params = ({key: f'{dt:%Y%m%d}'} for key, dt in product(
                     ('suspend_date', 'resume_date'),
-                    (i for i in get_dates('D') if max_dt < i <= get_last_td())
+                    get_calendar().range(max_dt + pd.Timedelta(days=1), get_last_td())
                 ))
 
         for q in query_params:
@@ -169,6 +172,7 @@ class AShareIndustry(CrawlerJob):
     def run(self, *args, **kwargs):
         for code, data in (*self.get_zz_industry(),):
             self.insert_data(data, msg=code, model=stock.AShareSector, ukeys=stock.AShareSector.uk_.columns)
+        refresh_membership()
 
     def get_zz_industry(self):
         with get_session() as session:
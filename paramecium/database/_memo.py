@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+跨进程的本地缓存, 结果以pickle保存在 `{local_store}/memo/{函数名}/` 下.
+每条缓存记录数据源各表 `max(updated_at)` 的摘要, 数据源有新数据写入后缓存自动失效.
+
+>>> @disk_memo(tables=('index_org_price', ))
+... def get_something(code, freq=FreqEnum.W):
+...     ...
+"""
+__all__ = ['source_marks', 'source_token', 'disk_memo', 'clear_memo', 'evict_memo']
+
+import hashlib
+import inspect
+import os
+import pickle
+import shutil
+import threading
+import time
+from datetime import date, datetime
+from enum import Enum
+from functools import wraps
+
+import pandas as pd
+import sqlalchemy as sa
+
+from ._postgres import get_session, get_or_create_table
+from ..configuration import get_local_path
+
+MAX_AGE = pd.Timedelta(days=30)
+MAX_BYTES = 1 << 30
+TOKEN_TTL = 60  # seconds to reuse a source token before checking database again
+
+_tokens = dict()  # tables -> (checked at, marks)
+_lock = threading.Lock()
+
+
+def source_marks(tables):
+    """
+    各表的 `max(updated_at)`, 结果缓存 `TOKEN_TTL` 秒
+
+    :param tables: table names
+    :return: dict of table -> isoformat str, None for empty table
+    """
+    tables = tuple(sorted(tables))
+    if not tables:
+        return dict()
+    with _lock:
+        checked_at, marks = _tokens.get(tables, (0, None))
+    if time.time() - checked_at < TOKEN_TTL:
+        return marks
+
+    with get_session() as session:
+        marks = {
+            t: session.execute(sa.select([sa.func.max(get_or_create_table(t).c.updated_at)])).scalar() for t in tables
+        }
+    marks = {t: m and m.isoformat() for t, m in marks.items()}
+    with _lock:
+        _tokens[tables] = (time.time(), marks)
+    return marks
+
+
+def source_token(tables):
+    """
+    数据源版本, 各表 `max(updated_at)` 的md5, 结果缓存 `TOKEN_TTL` 秒
+
+    :param tables: table names
+    :return: str
+    """
+    marks = source_marks(tables)
+    if not marks:
+        return ''
+    return hashlib.md5(repr(sorted(marks.items())).encode()).hexdigest()
+
+
+def _canonical(value):
+    """ 参数的规范形式, 相等的参数有相同的repr """
+    if isinstance(value, Enum):
+        return f'{type(value).__name__}.{value.name}'
+    if isinstance(value, (datetime, date)):
+        return pd.Timestamp(value).isoformat()
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _canonical(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(map(repr, map(_canonical, value))))
+    if isinstance(value, (list, tuple)):
+        return tuple(map(_canonical, value))
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return f'{type(value).__qualname__}({value!s})'
+
+
+def _memo_root(name=None):
+    return get_local_path('memo', *((name,) if name else ()))
+
+
+def clear_memo(name=None):
+    """
+    删除缓存
+
+    :param name: `module.qualname` of decorated function, None for all
+    """
+    shutil.rmtree(_memo_root(name), ignore_errors=True)
+
+
+def evict_memo(max_age=MAX_AGE, max_bytes=MAX_BYTES):
+    """ 删除超过 `max_age` 未使用的缓存, 总大小超过 `max_bytes` 时从最久未使用的开始删除 """
+    files = []
+    for path in _memo_root().glob('*/*.pkl'):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+
+    expired = time.time() - max_age.total_seconds()
+    total = sum(size for _, size, _ in files)
+    for used_at, size, path in sorted(files):
+        if used_at >= expired and total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+def disk_memo(tables, max_age=MAX_AGE):
+    """
+    decorator, 以 函数名+规范化参数 为键缓存结果
+
+    :param tables: source table names, entry is dropped when any of them has new `updated_at`
+    :param max_age: entries created before this period are recomputed
+    """
+
+    def decorator(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = hashlib.md5(repr(_canonical(bound.arguments)).encode()).hexdigest()
+            path = _memo_root(name).joinpath(f'{key}.pkl')
+            token = source_token(tables)
+
+            if path.exists():
+                try:
+                    with open(path, 'rb') as f:
+                        entry = pickle.load(f)
+                except Exception:
+                    entry = None
+                if entry and entry['token'] == token and time.time() - entry['created'] < max_age.total_seconds():
+                    os.utime(path)  # mtime is the last used time for eviction
+                    return entry['value']
+                path.unlink(missing_ok=True)
+
+            value = func(*args, **kwargs)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmp, 'wb') as f:
+                pickle.dump({'token': token, 'created': time.time(), 'value': value}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+            evict_memo()
+            return value
+
+        wrapper.cache_clear = lambda: clear_memo(name)
+        return wrapper
+
+    return decorator
@@ -5,13 +5,21 @@
 """
 __all__ = [
     'BaseORM', 'gen_oid', 'gen_update',
-    'get_sql_engine', 'get_session', 'try_commit',
-    'get_or_create_table', 'create_all_table', 'upsert_data', 'bulk_insert', 'clean_duplicates'
+    'configure_engine', 'get_sql_engine', 'get_session', 'try_commit',
+    'get_or_create_table', 'invalidate_tables', 'create_all_table', 'get_partitions', 'ensure_partitions', 'upsert_data', 'bulk_insert', 'copy_insert', 'fetch_frame',
+    'iter_frames', 'replace_dates', 'clean_duplicates'
 ]
 
+import datetime as dt
+import io
+import json
 import logging
+import threading
+import time
+from collections import defaultdict
 from contextlib import contextmanager
 
+import numpy as np
 import pandas as pd
 import sqlalchemy as sa
 import sqlalchemy.exc as sa_err
@@ -20,10 +28,15 @@ from sqlalchemy.dialects import postgresql as pg
 from sqlalchemy.engine.url import URL
 from sqlalchemy.ext.declarative import declarative_base
 
+from ._query_stats import record_query
 from ..configuration import get_data_config
+from ..const import FreqEnum
+from ..utils import chunk
 
 logger = logging.getLogger(__name__)
 
+_MAX_BIND_PARAMS = 32767  # postgresql limit of bind parameters in one statement
+
 
 def _df2list(raw_data):
     if isinstance(raw_data, pd.DataFrame):
@@ -32,6 +45,11 @@ def _df2list(raw_data):
         return raw_data
 
 
+def _norm_key(values):
+    """ make unique key values comparable between python input and database output """
+    return tuple(pd.Timestamp(v) if isinstance(v, (dt.date, np.datetime64)) else v for v in values)
+
+
 def try_commit(session, on_doing, success=''):
     try:
         session.commit()
@@ -65,26 +83,72 @@ BaseORM = declarative_base(
 )
 
 
+# one engine per process, created lazily so that importing does not need a database.
+_engine = None
+_engine_params = dict(pool_size=30, encoding='utf-8', pool_pre_ping=True, pool_recycle=3600)
+_engine_lock = threading.Lock()
+_Session = sa_orm.scoped_session(sa_orm.sessionmaker())  # echo=True
+
+
+def configure_engine(**kwargs):
+    """
+    设置共享engine的参数, 例如 `pool_size`, `max_overflow`, `pool_pre_ping`, `pool_recycle`.
+    已创建的engine会被释放, 下次使用时按新参数重建.
+    """
+    global _engine
+    with _engine_lock:
+        _engine_params.update(kwargs)
+        if _engine is not None:
+            _Session.remove()
+            _engine.dispose()
+            _engine = None
+
+
 def get_sql_engine(**kwargs):
-    params = dict(pool_size=30, encoding='utf-8')
-    params.update(**kwargs)
-    return sa.create_engine(URL(**get_data_config('postgres')), **params)
+    """
+    获取进程内共享的engine, 首次调用时创建
 
+    :param kwargs: if given, create a standalone engine with these parameters instead of the shared one
+    :return: sa.engine.Engine
+    """
+    global _engine
+    if kwargs:
+        return sa.create_engine(URL(**get_data_config('postgres')), **{**_engine_params, **kwargs})
 
-_Session = sa_orm.scoped_session(sa_orm.sessionmaker(bind=get_sql_engine()))  # echo=True
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = sa.create_engine(URL(**get_data_config('postgres')), **_engine_params)
+                _Session.configure(bind=_engine)
+    return _engine
 
 
 @contextmanager
 def get_session():
+    get_sql_engine()
     session = _Session()
     yield session
     session.close()
 
 
-def create_all_table():
+def create_all_table(partition_freq=None):
+    """
+    创建数据表, 视图及模型中声明但数据库中缺少的索引
+
+    :param partition_freq: FreqEnum.Y or FreqEnum.M, if given, tables in `PARTITIONED_TABLES` that do not exist yet
+        are created as range partitioned by `trade_dt`. Existing plain tables are never converted.
+    """
     from .pg_models import stock, fund, index, monitors, others
     logger.info('creating all sqlalchemy data models')
+    if partition_freq is not None:
+        existing = set(sa.inspect(get_sql_engine()).get_table_names())
+        for name in PARTITIONED_TABLES:
+            if name not in existing:
+                _create_partitioned(BaseORM.metadata.tables[name], partition_freq)
+            elif get_partitions(name) is None:
+                logger.warning(f'{name} exists as a plain table, keep it unpartitioned')
     BaseORM.metadata.create_all(get_sql_engine())
+    _create_missing_indexes(BaseORM.metadata.sorted_tables)
 
     # create some view for query.
     with get_session() as session:
@@ -101,68 +165,465 @@ def create_all_table():
         )
         try_commit(session, 'create index price view')
 
+    invalidate_tables()
 
-def get_or_create_table(name, *columns, **kwargs):
-    engine = get_sql_engine()  # echo=True
-    BaseORM.metadata.reflect(bind=engine, views=True)
-    if name not in BaseORM.metadata.tables:
-        if columns:
-            table = sa.Table(
-                name, BaseORM.metadata,
-                gen_oid(), gen_update(), *columns,
-                keep_existing=True, **kwargs
+
+def _create_missing_indexes(tables):
+    """ `create_all` skips existing tables, so indexes added to models later are created here """
+    with get_session() as session:
+        existing = {name for name, in session.execute(
+            "select indexname from pg_indexes where schemaname = current_schema()"
+        )}
+    for table in tables:
+        for idx in table.indexes:
+            if idx.name not in existing:
+                logger.info(f'create index {idx.name} on {table.name}')
+                idx.create(bind=get_sql_engine())
+
+
+# price tables that could be declaratively partitioned by range of `trade_dt`,
+# partitions are named as `{table}_y2020` or `{table}_m202001`.
+PARTITIONED_TABLES = ('stock_org_price', 'mf_org_nav', 'index_org_price', 'index_derivative_price')
+_PARTITION_FREQ = {FreqEnum.Y: ('y', 'Y', '%Y'), FreqEnum.M: ('m', 'M', '%Y%m')}
+_partitions = dict()  # table name -> (freq, set of partition names), None for plain tables
+
+
+def _create_partitioned(table, freq):
+    """ 创建按 `trade_dt` 范围分区的空表, 分区表的主键须包含分区字段, 索引由 `_create_missing_indexes` 补建 """
+    columns = [c.copy() for c in table.c]
+    for c in columns:
+        if c.name == 'trade_dt':
+            c.primary_key, c.nullable = True, False
+    sa.Table(
+        table.name, sa.MetaData(), *columns,
+        comment=table.comment, postgresql_partition_by='RANGE (trade_dt)'
+    ).create(bind=get_sql_engine())
+    logger.info(f'create table {table.name} partitioned by {freq.name}')
+
+    with _registry_lock:
+        _partitions[table.name] = (freq, set())
+    ensure_partitions(table.name, [dt.date.today()])
+
+
+def get_partitions(name):
+    """
+    查询数据表的分区频率及已有分区, 结果在进程内缓存
+
+    :param name: table name
+    :return: tuple of (FreqEnum, set of partition names), None if it is not a partitioned table
+    """
+    with _registry_lock:
+        if name not in _partitions:
+            with get_session() as session:
+                kind = session.execute(
+                    "select relkind from pg_class where oid = to_regclass(:name)", {'name': name}
+                ).scalar()
+                children = {row[0].split('.')[-1] for row in session.execute(
+                    "select inhrelid::regclass::text from pg_inherits where inhparent = to_regclass(:name)",
+                    {'name': name}
+                )}
+            if kind != 'p':
+                _partitions[name] = None
+            else:
+                # frequency is recognized by partition names, yearly by default.
+                freq = next((f for f, (tag, *_) in _PARTITION_FREQ.items()
+                             for child in children if child.startswith(f'{name}_{tag}')), FreqEnum.Y)
+                _partitions[name] = (freq, children)
+        return _partitions[name]
+
+
+def ensure_partitions(name, dates):
+    """
+    按写入数据的日期补建缺少的分区, 非分区表不做处理
+
+    :param name: table name
+    :param dates: iterable of date
+    """
+    info = get_partitions(name)
+    if info is None:
+        return
+    freq, existing = info
+    tag, period_freq, fmt = _PARTITION_FREQ[freq]
+
+    periods = pd.DatetimeIndex(pd.to_datetime(pd.Index([*dates]), errors='coerce').dropna()).to_period(period_freq)
+    missing = {f'{name}_{tag}{p.start_time:{fmt}}': p for p in periods.unique()}
+    missing = {k: p for k, p in missing.items() if k not in existing}
+    if not missing:
+        return
+
+    with _registry_lock, get_sql_engine().begin() as conn:
+        for child, period in sorted(missing.items()):
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {child} PARTITION OF {name} "
+                f"FOR VALUES FROM ('{period.start_time:%Y-%m-%d}') TO ('{(period + 1).start_time:%Y-%m-%d}')"
             )
-            table.create(bind=engine)
-        else:
-            raise sa_err.NoSuchTableError("Table")
+            logger.info(f'create partition {child}')
+        existing.update(missing.keys())
+
+
+def _ensure_record_partitions(table, records):
+    if 'trade_dt' not in table.c:
+        return
+    if isinstance(records, pd.DataFrame):
+        dates = records['trade_dt'] if 'trade_dt' in records.columns else ()
+    else:
+        dates = [r.get('trade_dt') for r in records]
+    ensure_partitions(table.name, dates)
+
 
-    return BaseORM.metadata.tables[name]
+# process-wide registry of tables reflected or created by `get_or_create_table`,
+# tables defined by orm models live in `BaseORM.metadata` already and are never invalidated.
+_reflected_tables = set()
+_registry_lock = threading.RLock()
+
+
+def get_or_create_table(name, *columns, **kwargs):
+    """
+    获取数据表, 仅反射所需的单张表(或视图)并缓存, 表不存在且给定 `columns` 时创建
+
+    :param name: table name
+    :param columns: sa.Column, used when create table
+    :param kwargs: other keyword arguments of sa.Table
+    :return: sa.Table
+    """
+    with _registry_lock:
+        if name not in BaseORM.metadata.tables:
+            try:
+                sa.Table(name, BaseORM.metadata, autoload=True, autoload_with=get_sql_engine())
+            except sa_err.NoSuchTableError:
+                if not columns:
+                    raise
+                table = sa.Table(
+                    name, BaseORM.metadata,
+                    gen_oid(), gen_update(), *columns,
+                    keep_existing=True, **kwargs
+                )
+                table.create(bind=get_sql_engine())
+                logger.info(f'create table {name}')
+            _reflected_tables.add(name)
+
+        return BaseORM.metadata.tables[name]
+
+
+def invalidate_tables(*names):
+    """
+    清除 `get_or_create_table` 缓存的表结构, 下次使用时重新反射
+
+    :param names: table names, all reflected tables if empty
+    """
+    with _registry_lock:
+        for name in (names if names else [*_reflected_tables]):
+            if name in _reflected_tables:
+                _reflected_tables.discard(name)
+                BaseORM.metadata.remove(BaseORM.metadata.tables[name])
+
+
+def _copy_format(ser, type_):
+    """ convert series into text that `COPY ... (FORMAT csv)` accepts for column type """
+    if isinstance(type_, sa.Date):
+        return pd.to_datetime(ser).dt.strftime('%Y-%m-%d')
+    elif isinstance(type_, sa.DateTime):
+        return pd.to_datetime(ser).dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+    elif isinstance(type_, sa.Boolean):
+        return ser.map({True: 't', False: 'f'})
+    elif isinstance(type_, sa.Integer):
+        return pd.to_numeric(ser).astype('Int64')
+    elif isinstance(type_, sa.Numeric):
+        return pd.to_numeric(ser)
+    elif isinstance(type_, sa.JSON):
+        return ser.map(json.dumps, na_action='ignore')
+    else:
+        return ser
+
+
+def _copy_frame(session, data, table, chunk_size=100000):
+    """
+    以 `COPY ... FROM STDIN` 写入DataFrame, 按目标表字段类型整理各列, 不生成逐行的python对象.
+    在session的事务内执行, 由调用方提交.
+
+    :param session: sqlalchemy session
+    :param data: DataFrame, columns not in table are ignored
+    :param table: sa.Table
+    :param chunk_size: rows of each csv buffer
+    :return: number of rows
+    """
+    columns = [c for c in table.c if c.key in data.columns]
+    frame = pd.DataFrame({c.key: _copy_format(data[c.key], c.type) for c in columns}, index=data.index)
+
+    preparer = session.get_bind().dialect.identifier_preparer
+    copy_sql = (f"COPY {preparer.format_table(table)} ({', '.join(preparer.quote(c.name) for c in columns)}) "
+                f"FROM STDIN WITH (FORMAT csv, NULL '')")
+    cursor = session.connection().connection.cursor()
+    for start in range(0, frame.shape[0], chunk_size):
+        buffer = io.StringIO()
+        frame.iloc[start:start + chunk_size].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        tic = time.perf_counter()
+        cursor.copy_expert(copy_sql, buffer)
+        record_query(copy_sql, time.perf_counter() - tic, cursor.rowcount)
+    return frame.shape[0]
+
+
+def copy_insert(data, model, chunk_size=100000):
+    """
+    Streaming DataFrame into postgresql with `COPY FROM STDIN`, much faster than orm bulk insert.
+
+    :param data: DataFrame
+    :param model: ORM model or sa.Table
+    :param chunk_size: rows of each copy buffer
+    """
+    table = model if isinstance(model, sa.Table) else model.__table__
+    _ensure_record_partitions(table, data)
+    with get_session() as session:
+        try:
+            _copy_frame(session, data, table, chunk_size)
+        except Exception as e:
+            logger.error(f'fail to copy data into {table.key} with {e!r}')
+            session.rollback()
+        else:
+            try_commit(session, f'copy data into {table.key}')
+
+
+def replace_dates(data, model, dates=None, date_col='trade_dt', chunk_size=100000):
+    """
+    在一个事务内删除若干日期的数据并以 `COPY` 写入新数据, 提交前读者看到的始终是旧数据, 失败时全部回滚.
+
+    :param data: DataFrame
+    :param model: ORM model or sa.Table
+    :param dates: dates to replace, default dates in `data`; dates without rows in `data` are cleared
+    :param date_col: date column
+    :param chunk_size: rows of each copy buffer
+    :return: tuple of (deleted rows, inserted rows)
+    """
+    table = model if isinstance(model, sa.Table) else model.__table__
+    if dates is None:
+        dates = data[date_col]
+    dates = [t.date() for t in pd.DatetimeIndex(dates).unique()]
+    if not data.empty:
+        _ensure_record_partitions(table, data)
+    with get_session() as session:
+        try:
+            deleted = session.execute(
+                sa.delete(table).where(table.c[date_col] == sa.any_(sa.literal(dates, pg.ARRAY(sa.Date))))
+            ).rowcount
+            inserted = _copy_frame(session, data, table, chunk_size) if not data.empty else 0
+            session.commit()
+        except Exception as e:
+            logger.error(f'fail to replace {len(dates)} dates of {table.key} with {e!r}')
+            session.rollback()
+            raise
+    return deleted, inserted
+
+
+def _column_kinds(stmt, categories=()):
+    """ how to type each selected column in the result frame """
+    kinds = dict()
+    for name, col in zip(stmt.c.keys(), stmt.c):
+        if name in categories:
+            kinds[name] = 'category'
+        elif isinstance(col.type, (sa.Date, sa.DateTime)):
+            kinds[name] = 'date'
+        elif isinstance(col.type, (sa.String, pg.UUID)):
+            kinds[name] = 'str'
+        elif isinstance(col.type, sa.Numeric):
+            kinds[name] = 'float'
+    return kinds
+
+
+def fetch_frame(query, categories=()):
+    """
+    以 `COPY (SELECT ...) TO STDOUT` 读取查询结果, 由pandas的C解析器直接按列生成DataFrame,
+    不再逐行构造Row对象再推断类型. 日期列为 datetime64, 字符列保持为str.
+
+    :param query: orm Query or sa.select
+    :param categories: names of columns convert to category
+    :return: DataFrame, with all selected columns even if empty
+    """
+    stmt = getattr(query, 'statement', query)
+    kinds = _column_kinds(stmt, categories)
+    date_cols = [k for k, v in kinds.items() if v == 'date']
+    dtypes = {k: {'category': 'category', 'str': object, 'float': float}[v] for k, v in kinds.items() if v != 'date'}
+
+    buffer = io.StringIO()
+    with get_session() as session:
+        compiled = stmt.compile(dialect=session.get_bind().dialect)
+        cursor = session.connection().connection.cursor()
+        select_sql = cursor.mogrify(str(compiled), compiled.params).decode()
+        tic = time.perf_counter()
+        cursor.copy_expert(f'COPY ({select_sql}) TO STDOUT WITH (FORMAT csv, HEADER true)', buffer)
+        seconds = time.perf_counter() - tic
+        buffer.seek(0)
+
+        frame = pd.read_csv(
+            buffer, dtype=dtypes, parse_dates=date_cols,
+            keep_default_na=False, na_values=[''], true_values=['t'], false_values=['f']
+        )
+        record_query(select_sql, seconds, frame.shape[0], cursor=cursor)
+
+    for col in date_cols:
+        # empty result or out-of-range dates are not parsed by `read_csv`
+        frame[col] = pd.to_datetime(frame[col], errors='coerce')
+    return frame
+
+
+def _typed_frame(rows, columns, kinds):
+    frame = pd.DataFrame.from_records([tuple(row) for row in rows], columns=columns)
+    for col, kind in kinds.items():
+        if kind == 'date':
+            frame[col] = pd.to_datetime(frame[col], errors='coerce')
+        elif kind == 'float':
+            frame[col] = pd.to_numeric(frame[col], errors='coerce')
+        elif kind == 'category':
+            frame[col] = frame[col].astype('category')
+    return frame
+
+
+def iter_frames(query, chunk_rows=100000, categories=(), split_by=None):
+    """
+    以服务端游标(named cursor)分块读取查询结果, 每块为按列类型转换后的DataFrame,
+    内存占用取决于 `chunk_rows` 而非结果集大小. 使用独立连接, 迭代期间可正常使用其他session.
+
+    :param query: orm Query or sa.select
+    :param chunk_rows: rows fetched from server each time
+    :param categories: names of columns convert to category
+    :param split_by: column name, rows with the same value never split into two chunks,
+        the query should be ordered by this column.
+    :return: generator of DataFrame
+    """
+    stmt = getattr(query, 'statement', query)
+    columns = stmt.c.keys()
+    kinds = _column_kinds(stmt, categories)
+    pos = columns.index(split_by) if split_by else None
+
+    with get_sql_engine().connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(stmt)
+        carry = []
+        while True:
+            rows = result.fetchmany(chunk_rows)
+            if not rows:
+                if carry:
+                    yield _typed_frame(carry, columns, kinds)
+                break
+
+            rows = [*carry, *rows]
+            if pos is None:
+                carry = []
+            else:
+                # keep rows of the last value for next chunk, it may continue there.
+                cut = len(rows)
+                while cut > 0 and rows[cut - 1][pos] == rows[-1][pos]:
+                    cut -= 1
+                rows, carry = rows[:cut], rows[cut:]
+
+            if rows:
+                yield _typed_frame(rows, columns, kinds)
 
 
 def bulk_insert(records, model):
+    if isinstance(records, pd.DataFrame):
+        return copy_insert(records, model)
+
+    records = [*records]
+    _ensure_record_partitions(model if isinstance(model, sa.Table) else model.__table__, records)
     with get_session() as session:
         if isinstance(model, sa.Table):
-            session.execute(pg.insert(model, _df2list(records)))
+            session.execute(pg.insert(model, records))
             try_commit(session, f'normal insert data for {model.key}')
         else:
-            session.bulk_insert_mappings(model, _df2list(records))
+            session.bulk_insert_mappings(model, records)
             try_commit(session, f'bulk insert data for {model.__tablename__}')
 
 
-def upsert_data(records, model, ukeys=None):
-    result_ids = []
+def upsert_data(records, model, ukeys=None, chunk_size=1000):
+    """
+    批量upsert, 字段相同的记录合并为一条多行 `INSERT ... VALUES ... ON CONFLICT` 语句, 减少网络往返
+
+    :param records: DataFrame or iterable of dict
+    :param model: ORM model
+    :param ukeys: unique columns for `ON CONFLICT`, plain insert if None
+    :param chunk_size: max rows in one statement
+    :return: list of primary keys in the same order as records
+    """
+    table = model.__table__
+    pk_cols = [table.c[c.key] for c in model.get_primary_key()]
+    uk_names = [c.key for c in ukeys] if ukeys else []
+
+    # the same row can not be affected twice in one statement,
+    # so merge records with the same unique key first, later one wins just like sequential upsert.
+    merged, order = dict(), []
+    for i, record in enumerate(_df2list(records)):
+        key = _norm_key(record.get(k) for k in uk_names) if uk_names else i
+        merged[key] = {**merged.get(key, {}), **record}
+        order.append(key)
+
+    # multi-values insert need the same fields for every row.
+    grouped = defaultdict(list)
+    for key, record in merged.items():
+        grouped[tuple(sorted(record.keys()))].append((key, record))
+
+    _ensure_record_partitions(table, merged.values())
+    key2pk = dict()
     with get_session() as session:
-        for record in _df2list(records):
-            insert_exe = pg.insert(model).values(**record)
-            if ukeys:
-                set_ = {k: sa.text(f'EXCLUDED.{k}') for k in {*record.keys()} - {*(c.key for c in ukeys)}}
-                insert_exe = insert_exe.on_conflict_do_update(
-                    index_elements=ukeys,
-                    set_={**set_, 'updated_at': sa.func.current_timestamp()}
-                )
-            exe_result = session.execute(insert_exe)
-            result_ids.extend(exe_result.inserted_primary_key)
+        for fields, group in grouped.items():
+            rows_limit = max(1, min(chunk_size, _MAX_BIND_PARAMS // max(len(fields), 1)))
+            for sub_group in chunk(group, rows_limit):
+                insert_exe = pg.insert(table).values([record for _, record in sub_group])
+                if uk_names:
+                    set_ = {k: insert_exe.excluded[k] for k in {*fields} - {*uk_names}}
+                    insert_exe = insert_exe.on_conflict_do_update(
+                        index_elements=uk_names,
+                        set_={**set_, 'updated_at': sa.func.current_timestamp()}
+                    ).returning(*pk_cols, *(table.c[k] for k in uk_names))
+                    # match returned rows by unique key, returning order is not guaranteed.
+                    for row in session.execute(insert_exe):
+                        row = tuple(row)
+                        key2pk[_norm_key(row[len(pk_cols):])] = row[:len(pk_cols)]
+                else:
+                    # rows of a single plain insert are returned in values order.
+                    exe_result = session.execute(insert_exe.returning(*pk_cols))
+                    key2pk.update(zip((key for key, _ in sub_group), (tuple(row) for row in exe_result)))
+
+        try_commit(session, f'upsert data for {table.key}')
+
+    return [pk for key in order for pk in key2pk.get(key, ())]
+
+
+def clean_duplicates(model, unique_cols, start=None, end=None, date_col='trade_dt'):
+    """
+    删除重复数据, 每组 `unique_cols` 只保留 `updated_at` 最新的一条, 全部在数据库端完成
+
+    :param model: ORM model
+    :param unique_cols: columns that should be unique
+    :param start: only clean rows with `date_col` >= start, optional
+    :param end: only clean rows with `date_col` <= end, optional
+    :param date_col: name of date column used by `start` and `end`
+    :return: number of rows removed
+    """
+    table = model.__table__
+    pk, *_ = model.get_primary_key()
+
+    filters = []
+    if start is not None:
+        filters.append(table.c[date_col] >= start)
+    if end is not None:
+        filters.append(table.c[date_col] <= end)
+
+    # later physical row wins when `updated_at` ties, e.g. rows inserted in the same transaction.
+    ranked = sa.select([
+        pk.label('pk'),
+        sa.func.row_number().over(
+            partition_by=unique_cols,
+            order_by=(table.c.updated_at.desc(), sa.literal_column('ctid').desc())
+        ).label('rn')
+    ])
+    if filters:
+        ranked = ranked.where(sa.and_(*filters))
+    ranked = ranked.alias('ranked')
 
-        try_commit(session, f'upsert data for {model.__tablename__}')
-
-    return result_ids
-
-
-def clean_duplicates(model, unique_cols):
     with get_session() as session:
-        labeled_cols = [c.label(c.key) for c in unique_cols]
-        pk, *_ = model.get_primary_key()
-        grouped = sa_orm.Query(labeled_cols).group_by(*unique_cols).having(
-            sa.func.count(pk) > 1
-        ).subquery('g')
-        duplicates = pd.DataFrame(
-            session.query(pk, *labeled_cols).join(
-                grouped, sa.and_(*(grouped.c[c.key] == c for c in unique_cols))
-            ).order_by(model.updated_at).all()
-        )
-        if not duplicates.empty:
-            session.query(model).filter(pk.in_(
-                duplicates.set_index(pk.name).loc[lambda df: df.duplicated(keep='last')].index.tolist()
-            )).delete(synchronize_session='fetch')
+        tic = time.time()
+        res = session.execute(sa.delete(table).where(pk == ranked.c.pk).where(ranked.c.rn > 1))
+        try_commit(session, f'clean duplicates for {table.key}')
+        logger.info(f'clean {res.rowcount} duplicates from {table.key} in {time.time() - tic:.2f}s')
 
-        try_commit(session, f'clean duplicates for {model.__tablename__}')
+    return res.rowcount
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+SQL查询统计, 默认关闭. 开启后记录每条语句的指纹, 耗时, 返回行数及调用方(因子/任务名称),
+超过阈值的慢查询记录 `EXPLAIN ANALYZE` 执行计划.
+
+>>> enable_query_stats(slow_ms=500)
+>>> with query_scope('my_factor'):
+...     get_price(AssetEnum.STOCK, '2020-01-02', '2020-01-02')
+>>> query_stats()
+"""
+__all__ = [
+    'enable_query_stats', 'disable_query_stats', 'reset_query_stats',
+    'query_scope', 'profile_queries', 'record_query', 'query_stats', 'query_report'
+]
+
+import contextvars
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+import pandas as pd
+import sqlalchemy as sa
+
+logger = logging.getLogger(__name__)
+
+_settings = {'enabled': False, 'slow_ms': None, 'explain': True}
+_stats = dict()  # (caller, fingerprint) -> [calls, seconds, max seconds, rows]
+_lock = threading.Lock()
+
+_caller = contextvars.ContextVar('query_caller', default='')
+_scopes = contextvars.ContextVar('query_scopes', default=())
+
+_FINGERPRINT_SUBS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),  # string literals
+    (re.compile(r'%\(\w+\)s|%s'), '?'),  # bind parameters
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),  # numbers
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'), '(...)'),  # IN lists and multi-values
+    (re.compile(r'(?:,\s*\(\.\.\.\))+'), ''),  # rows of multi-values insert
+    (re.compile(r'\s+'), ' '),
+)
+
+
+def fingerprint(statement):
+    """ 去掉参数及常量后的语句, 同一类查询的指纹相同 """
+    for pattern, repl in _FINGERPRINT_SUBS:
+        statement = pattern.sub(repl, statement)
+    return statement.strip()
+
+
+# start time is kept on the execution context, so a statement that raises leaves nothing behind.
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_stats_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_query_stats_start', None)
+    if start is not None:
+        del context._query_stats_start
+        record_query(statement, time.perf_counter() - start, cursor.rowcount, parameters=parameters, cursor=cursor)
+
+
+def enable_query_stats(slow_ms=None, explain=True):
+    """
+    开启查询统计, 作用于所有engine
+
+    :param slow_ms: queries slower than this are logged as slow query, None to disable
+    :param explain: run `EXPLAIN ANALYZE` for slow select and log the plan, note that the query is executed again.
+    """
+    _settings.update(slow_ms=slow_ms, explain=explain)
+    if not _settings['enabled']:
+        sa.event.listen(sa.engine.Engine, 'before_cursor_execute', _before_cursor_execute)
+        sa.event.listen(sa.engine.Engine, 'after_cursor_execute', _after_cursor_execute)
+        _settings['enabled'] = True
+
+
+def disable_query_stats():
+    """ 关闭查询统计, 已有的统计结果保留 """
+    if _settings['enabled']:
+        sa.event.remove(sa.engine.Engine, 'before_cursor_execute', _before_cursor_execute)
+        sa.event.remove(sa.engine.Engine, 'after_cursor_execute', _after_cursor_execute)
+        _settings['enabled'] = False
+
+
+def reset_query_stats():
+    with _lock:
+        _stats.clear()
+
+
+def _explain(cursor, statement, parameters):
+    """ run `EXPLAIN ANALYZE` in a savepoint, so a failure would not abort the caller's transaction """
+    dbapi_conn = cursor.connection
+    explain_cursor = dbapi_conn.cursor()
+    savepoint = not dbapi_conn.autocommit
+    try:
+        if savepoint:
+            explain_cursor.execute('SAVEPOINT query_stats_explain')
+        explain_cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS) {statement}', parameters or None)
+        plan = '\n'.join(row[0] for row in explain_cursor.fetchall())
+        if savepoint:
+            explain_cursor.execute('RELEASE SAVEPOINT query_stats_explain')
+        return plan
+    except Exception as e:
+        if savepoint:
+            explain_cursor.execute('ROLLBACK TO SAVEPOINT query_stats_explain')
+        return f'fail to explain with {e!r}'
+    finally:
+        explain_cursor.close()
+
+
+def record_query(statement, seconds, rows=-1, parameters=None, cursor=None):
+    """
+    记录一次查询, 供绕过sqlalchemy执行的语句(如 `COPY`)使用
+
+    :param statement: sql
+    :param seconds: elapsed time
+    :param rows: rows returned or affected, -1 if unknown
+    :param parameters: bind parameters of statement, used by `EXPLAIN`
+    :param cursor: dbapi cursor, slow select would be explained with its connection
+    """
+    if not _settings['enabled']:
+        return
+
+    rows = max(rows, 0)
+    key = (_caller.get(), fingerprint(statement))
+    for stats in (_stats, *_scopes.get()):
+        with _lock:
+            calls, total, longest, n = stats.get(key, (0, 0., 0., 0))
+            stats[key] = (calls + 1, total + seconds, max(longest, seconds), n + rows)
+
+    slow_ms = _settings['slow_ms']
+    if slow_ms is not None and seconds * 1000 >= slow_ms:
+        msg = f'slow query ({seconds * 1000:.0f}ms, {rows} rows) from {key[0] or "-"}: {key[1][:500]}'
+        if _settings['explain'] and cursor is not None and re.match(r'\s*(select|with)\b', statement, re.I):
+            msg = f'{msg}\n{_explain(cursor, statement, parameters)}'
+        logger.warning(msg)
+
+
+def _to_frame(stats):
+    data = pd.DataFrame(
+        [(*key, *val) for key, val in stats.items()],
+        columns=['caller', 'fingerprint', 'calls', 'total_ms', 'max_ms', 'rows']
+    )
+    data[['total_ms', 'max_ms']] *= 1000
+    return data.assign(mean_ms=data['total_ms'] / data['calls']).sort_values('total_ms', ascending=False, ignore_index=True)
+
+
+def query_stats():
+    """
+    进程内的查询统计
+
+    :return: DataFrame with columns caller, fingerprint, calls, total_ms, max_ms, rows, mean_ms; sorted by total_ms
+    """
+    with _lock:
+        return _to_frame(dict(_stats))
+
+
+def query_report(stats=None, top=10):
+    """
+    按耗时排序的查询汇总
+
+    :param stats: DataFrame from `query_stats`, default all queries of this process
+    :param top: number of fingerprints to show
+    :return: str
+    """
+    if stats is None:
+        stats = query_stats()
+    if stats.empty:
+        return 'no query recorded'
+    lines = [f"{stats['calls'].sum()} queries in {stats['total_ms'].sum() / 1000:.2f}s, top {top}:"]
+    for _, row in stats.head(top).iterrows():
+        lines.append(
+            f"{row['total_ms']:10.0f}ms {row['calls']:6d} calls {row['mean_ms']:8.1f}ms/call {row['rows']:9d} rows "
+            f"[{row['caller'] or '-'}] {row['fingerprint'][:200]}"
+        )
+    return '\n'.join(lines)
+
+
+@contextmanager
+def query_scope(name):
+    """
+    标记查询的调用方, 开启统计时在最外层scope结束后输出该scope内的查询汇总
+
+    :param name: caller name, such as factor or job name
+    """
+    outermost = not _scopes.get()
+    stats = dict()
+    caller_token = _caller.set(name)
+    scopes_token = _scopes.set((*_scopes.get(), stats))
+    try:
+        yield
+    finally:
+        _scopes.reset(scopes_token)
+        _caller.reset(caller_token)
+        if outermost and _settings['enabled']:
+            with _lock:
+                stats = dict(stats)
+            logger.info(f'query report of {name}: {query_report(_to_frame(stats))}')
+
+
+def profile_queries(get_name):
+    """
+    decorator of method, run it inside `query_scope`
+
+    :param get_name: callable, receive the instance and return the caller name
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with query_scope(get_name(self)):
+                return func(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+按日期批量计算的universe, 成分保存为 日期×代码 的位矩阵, 以 `str(universe)` 为键缓存在本地::
+
+    {local_store}/universe/{md5(str(universe))}.npz  # compacted
+    {local_store}/universe/{md5(str(universe))}.{time}.{pid}.npz  # dates appended later
+
+缓存记录 `source_tables` 的版本, 这些表有新数据写入后整体重新计算;
+`dated_sources` 只使新写入数据日期及之后的日期失效, 适用于每日写入的行情/持仓表.
+"""
+import abc
+import hashlib
+import importlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+from ._memo import source_marks, source_token
+from ._postgres import get_session, get_or_create_table
+from ..configuration import get_local_path
+from ..interface import AbstractUniverse
+
+MAX_PARTS = 32
+_lock = threading.RLock()
+
+
+def _rebuild(module, name, args):
+    return getattr(importlib.import_module(module), name)(*args)
+
+
+class CachedUniverse(AbstractUniverse):
+    """
+    子类实现 `compute_range` 一次计算多个日期的成分, 已计算过的日期从缓存读取.
+    `__str__` 需包含全部参数, 参数不同的universe不能共用缓存.
+    """
+    source_tables = ()  # any new row invalidates all dates
+    dated_sources = dict()  # table -> date column, new rows invalidate dates not earlier than their date
+
+    @abc.abstractmethod
+    def _init_args(self):
+        """ positional arguments of `__init__` to rebuild this universe """
+        return ()
+
+    def __reduce__(self):
+        # class names are bound to the cached constructors (`lru_cache`), so unpickle through them.
+        return _rebuild, (type(self).__module__, type(self).__qualname__, self._init_args())
+
+    @abc.abstractmethod
+    def compute_range(self, dates):
+        """
+        计算多个日期的成分
+
+        :param dates: sorted DatetimeIndex
+        :return: DataFrame of bool, index is dates and columns are codes
+        """
+        return pd.DataFrame(dtype=bool)
+
+    @property
+    def cache_path(self):
+        """ compacted cache, new dates are appended as parts `{md5}.{time}.{pid}.npz` """
+        return get_local_path('universe', f'{hashlib.md5(str(self).encode()).hexdigest()}.npz')
+
+    def _cache_files(self):
+        path = self.cache_path
+        parts = sorted(path.parent.glob(f'{path.stem}.*.npz'), key=lambda p: int(p.name.split('.')[1]))
+        return [path, *parts] if path.exists() else parts
+
+    def _changed_since(self, marks):
+        """ first date of `dated_sources` rows written after `marks`, None if nothing changed """
+        changed = []
+        with get_session() as session:
+            for name, date_col in self.dated_sources.items():
+                table = get_or_create_table(name)
+                query = sa.select([sa.func.min(table.c[date_col])])
+                if marks.get(name):
+                    query = query.where(table.c.updated_at > pd.Timestamp(marks[name]))
+                first = session.execute(query).scalar()
+                if first is not None:
+                    changed.append(pd.Timestamp(first))
+        return min(changed) if changed else None
+
+    def _read_cache(self, token, marks):
+        if getattr(self, '_state', None) == (token, marks):
+            return self._matrix
+
+        frames, file_marks = [], dict()
+        for path in self._cache_files():
+            try:
+                with np.load(path, allow_pickle=False) as npz:
+                    if str(npz['token']) != token:
+                        continue
+                    codes = npz['codes']
+                    bits = np.unpackbits(npz['bits'], axis=1, count=codes.size).astype(bool)
+                    frames.append(pd.DataFrame(bits, index=pd.DatetimeIndex(npz['dates']), columns=codes))
+                    for name, mark in json.loads(str(npz['marks'])).items():
+                        # the oldest mark of all files, so that changes after any of them are found.
+                        if name not in file_marks or (file_marks[name] and (mark is None or mark < file_marks[name])):
+                            file_marks[name] = mark
+            except (OSError, ValueError, KeyError):
+                continue
+
+        matrix = self._merge(frames)
+        if frames and self.dated_sources and file_marks != marks:
+            first = self._changed_since(file_marks)
+            if first is not None:
+                # rows before the changed date are still valid, and compacted with the new marks.
+                matrix = matrix.loc[matrix.index < first]
+                self._write_cache(matrix, token, marks, compact=True)
+        self._matrix, self._state = matrix, (token, marks)
+        return matrix
+
+    @staticmethod
+    def _merge(frames):
+        """ concat cached frames, later one wins for the same date """
+        if not frames:
+            return pd.DataFrame(dtype=bool, index=pd.DatetimeIndex([]))
+        codes = pd.Index(sorted(set().union(*(f.columns for f in frames))), dtype=object)
+        matrix = pd.concat([f.reindex(columns=codes, fill_value=False) for f in frames])
+        return matrix.loc[~matrix.index.duplicated(keep='last')].sort_index().astype(bool)
+
+    def _write_cache(self, matrix, token, marks, compact=False):
+        """ append `matrix` as a new part, or replace all files with it if `compact` """
+        path = self.cache_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        target = path if compact else path.with_name(f'{path.stem}.{time.time_ns()}.{os.getpid()}.npz')
+        tmp = target.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp, 'wb') as f:
+            np.savez(
+                f, dates=matrix.index.values.astype('datetime64[D]'), codes=np.asarray(matrix.columns, dtype=str),
+                bits=np.packbits(matrix.values, axis=1), token=np.asarray(token), marks=np.asarray(json.dumps(marks)),
+            )
+        if compact:
+            for part in self._cache_files():
+                if part != path:
+                    part.unlink(missing_ok=True)
+        os.replace(tmp, target)
+
+    def clear_cache(self):
+        with _lock:
+            self._state = None
+            for path in self._cache_files():
+                path.unlink(missing_ok=True)
+
+    def get_instruments_range(self, dates):
+        dates = pd.DatetimeIndex(dates).unique().sort_values()
+        token = source_token(self.source_tables)
+        marks = source_marks(self.dated_sources)
+        with _lock:
+            matrix = self._read_cache(token, marks)
+            missing = dates.difference(matrix.index)
+            if missing.size:
+                new = self.compute_range(missing).astype(bool)
+                matrix = self._merge([matrix, new])
+                # only the new dates are written, parts are compacted once there are too many of them.
+                compact = len(self._cache_files()) >= MAX_PARTS
+                self._write_cache(matrix if compact else new, token, marks, compact=compact)
+                self._matrix = matrix
+        return matrix.reindex(index=dates)
+
+    def get_instruments(self, dt):
+        flags = self.get_instruments_range([dt]).iloc[0]
+        return {*flags.index[flags.values]}
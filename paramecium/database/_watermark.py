@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+因子输入水位: 每个因子日期记录计算窗口内各数据源的 `max(updated_at)`,
+数据源在窗口内有新写入时该日期过期, 只需重新计算过期日期及新日期.
+"""
+__all__ = ['input_watermarks', 'saved_watermarks', 'save_watermarks']
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+from ._postgres import get_or_create_table, fetch_frame, upsert_data
+from .pg_models import monitors
+
+
+def input_watermarks(factor, dates):
+    """
+    各日期计算窗口内, 因子数据源 `factor.inputs` 的 `max(updated_at)`
+
+    :param factor: AbstractFactor
+    :param dates: factor dates
+    :return: DataFrame, index is dates and columns are source tables, NaT if no row in window
+    """
+    dates = pd.DatetimeIndex(dates)
+    result = pd.DataFrame(index=dates, columns=[*factor.inputs], dtype='datetime64[ns]')
+    if dates.empty:
+        return result
+
+    windows = [factor.input_window(t) for t in dates]
+    lo = pd.DatetimeIndex([w[0] for w in windows])
+    hi = pd.DatetimeIndex([w[1] for w in windows])
+    for name, date_col in factor.inputs.items():
+        table = get_or_create_table(name)
+        # one grouped scan per table, window max is then taken over the daily marks.
+        daily = fetch_frame(
+            sa.select([table.c[date_col].label('dt'), sa.func.max(table.c.updated_at).label('watermark')]).where(
+                table.c[date_col].between(lo.min(), hi.max())
+            ).group_by(table.c[date_col])
+        ).sort_values('dt')
+        day_values = daily['dt'].values
+        marks = daily['watermark'].values
+        start = day_values.searchsorted(lo.values, side='left')
+        stop = day_values.searchsorted(hi.values, side='right')
+        result[name] = [marks[i:j].max() if j > i else np.datetime64('NaT') for i, j in zip(start, stop)]
+    return result
+
+
+def saved_watermarks(key, dates=None):
+    """
+    已记录的水位
+
+    :param key: factor key
+    :param dates: factor dates, default all
+    :return: DataFrame, index is trade_dt and columns are source tables
+    """
+    model = monitors.FactorWatermark.__table__
+    query = sa.select([model.c.trade_dt, model.c.source, model.c.watermark]).where(
+        model.c.target_table == key).order_by(model.c.oid)
+    # tables created before the unique key may hold duplicated records, the later one wins.
+    data = fetch_frame(query).drop_duplicates(['trade_dt', 'source'], keep='last').pivot(
+        index='trade_dt', columns='source', values='watermark')
+    return data if dates is None else data.reindex(index=pd.DatetimeIndex(dates))
+
+
+def save_watermarks(key, marks):
+    """
+    记录水位, 覆盖同一日期同一数据源的旧记录
+
+    :param key: factor key
+    :param marks: DataFrame from `input_watermarks`
+    """
+    if marks.empty or marks.columns.empty:
+        return
+    records = [
+        {'target_table': key, 'trade_dt': dt, 'source': source, 'watermark': None if pd.isna(mark) else mark}
+        for dt, row in marks.iterrows() for source, mark in row.items()
+    ]
+    model = monitors.FactorWatermark
+    upsert_data(records, model, ukeys=[model.target_table, model.trade_dt, model.source])
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+交易日历, 各频率的交易日保存为有序数组, 日期运算均为二分查找.
+"""
+__all__ = ['TradingCalendar', 'get_calendar']
+
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+from ._postgres import fetch_frame
+from .pg_models import others
+from ..const import FreqEnum
+
+
+def _to_freq(freq):
+    if freq is None or isinstance(freq, FreqEnum):
+        return freq
+    return FreqEnum[freq.upper()]
+
+
+class TradingCalendar(object):
+    """
+    交易日历
+
+    日期参数可以是单个日期(返回 pd.Timestamp)或日期数组(返回 DatetimeIndex), 超出日历范围的结果为 NaT.
+    `freq` 可以是 FreqEnum 或其名称, None 表示日历表中的全部日期.
+    """
+
+    def __init__(self, calendar: pd.DataFrame):
+        """
+        :param calendar: DataFrame with columns `trade_dt` and flag columns `is_d`, `is_w`, ...
+        """
+        calendar = calendar.assign(trade_dt=pd.to_datetime(calendar['trade_dt'])).sort_values('trade_dt')
+        self._dates = {None: pd.DatetimeIndex(calendar['trade_dt'].unique())}
+        for freq in FreqEnum:
+            flag = calendar[f'is_{freq.name.lower()}'].eq(1)
+            self._dates[freq] = pd.DatetimeIndex(calendar.loc[flag, 'trade_dt'].unique())
+
+    def dates(self, freq=FreqEnum.D):
+        """ 全部交易日, DatetimeIndex """
+        return self._dates[_to_freq(freq)]
+
+    def _lookup(self, dt, freq, side):
+        dates = self.dates(freq)
+        scalar = np.ndim(dt) == 0
+        values = pd.DatetimeIndex([dt] if scalar else dt).values
+        return dates, scalar, values, dates.values.searchsorted(values, side=side)
+
+    @staticmethod
+    def _take(dates, pos, scalar):
+        valid = (pos >= 0) & (pos < dates.size)
+        if dates.empty:
+            result = pd.DatetimeIndex(np.full(pos.shape, np.datetime64('NaT')))
+        else:
+            result = pd.DatetimeIndex(np.where(valid, dates.values[np.clip(pos, 0, dates.size - 1)], np.datetime64('NaT')))
+        return result[0] if scalar else result
+
+    def prev(self, dt, freq=FreqEnum.D, strict=False):
+        """
+        不晚于 `dt` 的最后一个交易日
+
+        :param strict: if True, strictly earlier than `dt`
+        """
+        dates, scalar, _, pos = self._lookup(dt, freq, 'left' if strict else 'right')
+        return self._take(dates, pos - 1, scalar)
+
+    def next(self, dt, freq=FreqEnum.D, strict=False):
+        """
+        不早于 `dt` 的第一个交易日
+
+        :param strict: if True, strictly later than `dt`
+        """
+        dates, scalar, _, pos = self._lookup(dt, freq, 'right' if strict else 'left')
+        return self._take(dates, pos, scalar)
+
+    def offset(self, dt, n, freq=FreqEnum.D):
+        """
+        以 `prev(dt)` 为基准偏移 `n` 个交易日, n < 0 向前
+
+        >>> cal.offset('2020-06-06', -1)  # Saturday, anchored at Friday 2020-06-05
+        Timestamp('2020-06-04 00:00:00')
+        """
+        dates, scalar, _, pos = self._lookup(dt, freq, 'right')
+        pos = pos - 1 + n
+        # base date before the first trade date has no anchor.
+        return self._take(dates, np.where(pos - n < 0, -1, pos), scalar)
+
+    def range(self, start=None, end=None, freq=FreqEnum.D):
+        """ [start, end] 之间的交易日, DatetimeIndex """
+        dates = self.dates(freq)
+        lo = 0 if start is None else dates.values.searchsorted(np.datetime64(pd.Timestamp(start)), side='left')
+        hi = dates.size if end is None else dates.values.searchsorted(np.datetime64(pd.Timestamp(end)), side='right')
+        return dates[lo:hi]
+
+    def is_period_end(self, dt, freq=FreqEnum.M):
+        """ `dt` 是否为该频率的交易日(周/月/季/年末), 返回bool或bool数组 """
+        dates, scalar, values, pos = self._lookup(dt, freq, 'left')
+        found = (pos < dates.size) & (dates.values[np.clip(pos, 0, dates.size - 1)] == values) if dates.size else pos < 0
+        return bool(found[0]) if scalar else found
+
+    def period_end(self, dt, freq=FreqEnum.M):
+        """ 日期所在周期的最后一个交易日, 即不早于该日期的第一个 `freq` 交易日 """
+        return self.next(dt, freq)
+
+
+@lru_cache()
+def get_calendar() -> TradingCalendar:
+    """
+    交易日历, 首次使用时读取 `trade_calendar` 并缓存, 日历更新后调用 `get_calendar.cache_clear()`
+    """
+    model = others.TradeCalendar.__table__
+    return TradingCalendar(fetch_frame(sa.select([model.c.trade_dt, *(model.c[f'is_{f.name.lower()}'] for f in FreqEnum)])))
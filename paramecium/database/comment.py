@@ -8,14 +8,15 @@ from functools import lru_cache
 import numpy as np
 import pandas as pd
 import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as pg
 
-from ._postgres import get_session, get_or_create_table
-from ._tool import flat_1dim
+from ._postgres import get_or_create_table, fetch_frame, iter_frames
+from .calendar_ import get_calendar
+from .price_store import get_price_store, sample_windows
 from .pg_models import others
 from ..const import FreqEnum, AssetEnum
 
 
-@lru_cache()
 def get_dates(freq=None):
     """
     获取A股交易日
@@ -23,14 +24,7 @@ def get_dates(freq=None):
     :param freq: str or FreqEnum
     :return: DatetimeIndex
     """
-    with get_session() as session:
-        query = session.query(others.TradeCalendar.trade_dt)
-        if freq:
-            if isinstance(freq, FreqEnum):
-                freq = freq.name
-            query = query.filter(getattr(others.TradeCalendar, f'is_{freq.lower()}') == 1)
-        data = flat_1dim(query.all())
-    return pd.to_datetime(sorted(data))
+    return get_calendar().dates(freq)
 
 
 def get_last_td() -> pd.Timestamp:
@@ -40,25 +34,52 @@ def get_last_td() -> pd.Timestamp:
     cur_date = pd.Timestamp.now()
     if cur_date.hour <= 22:
         cur_date -= pd.Timedelta(days=1)
-    return max((t for t in get_dates(freq=FreqEnum.D) if t <= cur_date))
+    return get_calendar().prev(cur_date)
 
 
 @lru_cache()
 def _basic_rates(type_='save'):
-    with get_session() as ss:
-        query_df = ss.query(
-            others.InterestRate.change_dt.label('trade_dt'),
-            getattr(others.InterestRate, f'{type_}_rate')
-        ).all()
+    """ 基准利率的阶梯函数: (调整日期数组, 利率数组), 按日期排序 """
+    model = others.InterestRate.__table__
+    data = fetch_frame(sa.select([model.c.change_dt, model.c[f'{type_}_rate']]).order_by(model.c.change_dt))
+    data = data.dropna().drop_duplicates('change_dt', keep='last')
+    return data['change_dt'].values, data[f'{type_}_rate'].values / 100
+
+
+def rf_at(dates, type_='save', freq=FreqEnum.D):
+    """
+    任意日期的无风险利率, 取不晚于该日期的最近一次基准利率, 早于首次调整的日期取首个利率
+
+    :param dates: array of dates
+    :param type_: save or loan
+    :param freq: FreqEnum, rate is compounded to this frequency
+    :return: Series indexed by dates
+    """
+    dates = pd.DatetimeIndex(dates)
+    change_dt, rates = _basic_rates(type_)
+    pos = np.clip(change_dt.searchsorted(dates.values, side='right') - 1, 0, None)
+    return pd.Series((1 + rates[pos]) ** (1 / freq.value) - 1, index=dates)
+
 
-    return {pd.Timestamp(t): (rate / 100) for t, rate in query_df}
+@lru_cache(maxsize=32)
+def _rate_curve(type_, freq, end):
+    return rf_at(get_calendar().range(end=end, freq=freq), type_, freq)
 
 
 def get_risk_free_rates(type_='save', freq=FreqEnum.D):
-    basic_rates = pd.Series(_basic_rates(type_))
-    daily_rates = basic_rates.reindex(index=pd.date_range('1900-01-01', pd.Timestamp.now(), freq='D'))
-    rf = daily_rates.ffill().bfill().add(1).pow(1 / freq.value).sub(1)
-    return rf.filter(items=get_dates(freq))
+    """
+    各交易日(截至当前)的无风险利率, 按 `(type_, freq, 最新交易日)` 缓存, 新交易日到来时自动延长
+
+    :return: Series indexed by trade dates of `freq`
+    """
+    dates = get_calendar().range(end=pd.Timestamp.now(), freq=freq)
+    return _rate_curve(type_, freq, dates[-1] if dates.size else None).copy()
+
+
+def invalidate_rate_curves():
+    """ 基准利率更新后清除缓存 """
+    _basic_rates.cache_clear()
+    _rate_curve.cache_clear()
 
 
 def get_instruments_info(asset: AssetEnum):
@@ -68,14 +89,11 @@ def get_instruments_info(asset: AssetEnum):
         AssetEnum.INDEX: 'index_org_description',
     }
     model = get_or_create_table(name=tb_dict[asset])
+    data = fetch_frame(sa.select([c for c in model.c if c.key not in ('oid', 'updated_at')]))
+    return data.set_index('wind_code')
 
-    with get_session() as session:
-        data = session.query(*(c for c in model.c if c.key not in ('oid', 'updated_at'))).all()
-
-    return pd.DataFrame(data).fillna(np.nan).set_index('wind_code')
 
-
-def get_price(asset: AssetEnum, start=None, end=None, code=None, fields=None):
+def _price_select(asset: AssetEnum, start=None, end=None, code=None, fields=None, dates=None, asof=False):
     tb_dict = {
         AssetEnum.STOCK: 'stock_org_price',
         AssetEnum.CMF: 'mf_org_nav',
@@ -84,7 +102,18 @@ def get_price(asset: AssetEnum, start=None, end=None, code=None, fields=None):
     model = get_or_create_table(name=tb_dict[asset])
 
     filters = []
-    if start and end and start == end:
+    if dates is not None:
+        lo, hi = sample_windows(dates)
+        if hi.empty:
+            filters.append(sa.false())
+        else:
+            # explicit bounds let the planner prune partitions.
+            filters.extend([
+                model.c.trade_dt > lo[0] if asof else model.c.trade_dt >= hi[0], model.c.trade_dt <= hi[-1]
+            ])
+        if not asof and not hi.empty:
+            filters.append(model.c.trade_dt == sa.any_(sa.literal([t.date() for t in hi], pg.ARRAY(sa.Date))))
+    elif start and end and start == end:
         filters.append(model.c.trade_dt == start)
     else:
         if start:
@@ -95,16 +124,57 @@ def get_price(asset: AssetEnum, start=None, end=None, code=None, fields=None):
         filters.append(model.c.wind_code == code)
 
     if fields:
-        sa_fields = (getattr(model.c, c) for c in {*fields, 'wind_code', 'trade_dt'})
+        sa_fields = [getattr(model.c, c) for c in {*fields, 'wind_code', 'trade_dt'}]
     else:
-        sa_fields = (c for c in model.c if c.key not in ('oid', 'updated_at'))
+        sa_fields = [c for c in model.c if c.key not in ('oid', 'updated_at')]
+
+    if dates is not None and asof:
+        # the last row of each code in every window (previous sample date, sample date], labeled by sample date.
+        window = sa.select([
+            sa.func.unnest(sa.literal([t.date() for t in lo], pg.ARRAY(sa.Date)), type_=sa.Date).label('lo'),
+            sa.func.unnest(sa.literal([t.date() for t in hi], pg.ARRAY(sa.Date)), type_=sa.Date).label('sample_dt'),
+        ]).alias('sample_window')
+        return sa.select(
+            [window.c.sample_dt.label('trade_dt') if c.key == 'trade_dt' else c for c in sa_fields]
+        ).select_from(
+            model.join(window, sa.and_(model.c.trade_dt > window.c.lo, model.c.trade_dt <= window.c.sample_dt))
+        ).where(sa.and_(*filters)).distinct(
+            window.c.sample_dt, model.c.wind_code
+        ).order_by(window.c.sample_dt, model.c.wind_code, model.c.trade_dt.desc())
+
+    return sa.select(sa_fields).where(sa.and_(*filters))
+
+
+def get_price(asset: AssetEnum, start=None, end=None, code=None, fields=None, dates=None, asof=False):
+    """
+    行情数据, 本地行情库与数据库一致时从本地读取
+
+    :param asset: AssetEnum
+    :param start: start date, optional
+    :param end: end date, optional
+    :param code: wind code, optional
+    :param fields: columns besides `wind_code` and `trade_dt`, default all
+    :param dates: only fetch these trade dates, `start` and `end` are ignored
+    :param asof: used with `dates`, if a code has no row on a sample date,
+        take its last row after the previous sample date, `trade_dt` is the sample date.
+    :return: DataFrame sorted by trade_dt
+    """
+    store = get_price_store(asset)
+    if store.is_fresh():
+        return store.read(start, end, code, fields, dates=dates, asof=asof)
+    data = fetch_frame(_price_select(asset, start, end, code, fields, dates=dates, asof=asof))
+    return data.sort_values('trade_dt', kind='mergesort')  # stable, keeps the order of duplicated rows
 
-    with get_session() as session:
-        data = pd.DataFrame(session.query(*sa_fields).filter(*filters).all()).fillna(np.nan)
 
-    data.loc[:, 'trade_dt'] = pd.to_datetime(data['trade_dt'])
+def iter_price(asset: AssetEnum, start=None, end=None, code=None, fields=None, chunk_rows=100000):
+    """
+    分块读取行情, 参数同 `get_price`. 按 `trade_dt` 排序, 每块约 `chunk_rows` 行且不会拆分同一交易日,
+    适用于全市场长区间数据.
 
-    return data.sort_values('trade_dt')
+    :return: generator of DataFrame
+    """
+    query = _price_select(asset, start, end, code, fields)
+    return iter_frames(query.order_by(query.c.trade_dt), chunk_rows=chunk_rows, split_by='trade_dt')
 
 
 def get_sector(asset: AssetEnum, valid_dt, sector_prefix=None):
@@ -115,7 +185,7 @@ def get_sector(asset: AssetEnum, valid_dt, sector_prefix=None):
             valid_dt <= model.c.remove_dt
         ]
         if sector_prefix:
-            filters.append(sa.func.substr(model.sector_code, 1, len(sector_prefix)) == sector_prefix)
+            filters.append(sa.func.substr(model.c.sector_code, 1, len(sector_prefix)) == sector_prefix)
     elif asset == AssetEnum.CMF:
         # Temporary solution
         model = get_or_create_table(name='mf_org_sector_m')
@@ -125,10 +195,5 @@ def get_sector(asset: AssetEnum, valid_dt, sector_prefix=None):
     else:
         raise KeyError(f"Unknown asset type {asset}.")
 
-    with get_session() as session:
-        sa_fields = (c for c in model.c if c.key not in ('oid', 'updated_at'))
-        data = pd.DataFrame(session.query(*sa_fields).filter(*filters).all()).fillna(np.nan)
-        for t_col in {'entry_dt', 'remove_dt', 'trade_dt'} & {*data.columns}:
-            data.loc[:, t_col] = pd.to_datetime(data[t_col])
-
-    return data
+    sa_fields = [c for c in model.c if c.key not in ('oid', 'updated_at')]
+    return fetch_frame(sa.select(sa_fields).where(sa.and_(*filters)))
@@ -3,18 +3,32 @@
 @Time: 2020/6/8 10:18
 @Author: Sue Zhu
 """
+import abc
 import importlib
+import multiprocessing
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 
 import numpy as np
 import pandas as pd
 import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as pg
 
 from ._postgres import *
-from .comment import get_dates, get_last_td
+from ._watermark import input_watermarks, saved_watermarks, save_watermarks
+from .calendar_ import get_calendar
+from .comment import get_last_td
 from .pg_models import monitors
+from ..configuration import get_local_path, get_option
+from ..const import FreqEnum
 from ..exc import DataExistError
 from ..interface import AbstractFactorIO, AbstractFactor
 
+_worker_factor = None
+
 
 def _sql_name(factor):
     return f"{factor.asset_type.value}_factor_{factor.name}"
@@ -37,7 +51,217 @@ def add_factor_to_monitor(module_path, params=None, freq='M', active=1):
     )
 
 
-class FactorDBTool(AbstractFactorIO):
+def _init_worker(factor):
+    """ 子进程初始化, 因子对象及fork前已加载的缓存(日历, 行情面板等)作为只读上下文 """
+    global _worker_factor
+    _worker_factor = factor
+    configure_engine(pool_size=2, max_overflow=2)
+
+
+def _compute_in_worker(dt):
+    return _worker_factor.compute(dt)
+
+
+class _FactorIO(AbstractFactorIO):
+    """
+    各存储方式共用的计算流程, 子类实现读写
+    """
+
+    @property
+    def key(self):
+        """ 因子存储名称, 数据库表名或本地目录名 """
+        return _sql_name(self._factor)
+
+    @abc.abstractmethod
+    def exist_dates(self, dates):
+        """ `dates` 中已有数据的日期 """
+        return []
+
+    @abc.abstractmethod
+    def write_snapshots(self, snapshots):
+        """
+        替换多个日期的截面, 空截面会清除该日期的旧数据
+
+        :param snapshots: dict of trade_dt -> DataFrame indexed by wind_code
+        :return: tuple of (deleted rows, inserted rows)
+        """
+        return 0, 0
+
+    @abc.abstractmethod
+    def get_max_date(self):
+        return None
+
+    def localized_snapshot(self, dt, if_exist=1):
+        """
+        计算并保存单日因子
+        """
+        self.localized_snapshots([dt], if_exist)
+
+    def localized_snapshots(self, dates, if_exist=1):
+        """
+        计算多个日期的因子, 全部计算完成后一次写入, 计算失败时不会留下只删除了旧数据的日期
+        """
+        if if_exist != 1:
+            exist = self.exist_dates(dates)
+            if exist:
+                msg = f"factor data at {exist[0]:%Y-%m-%d} is exist, please turn into replace mode or check your code!"
+                raise DataExistError(msg)
+
+        # read before computing, so that rows written during the computation make the date stale next time.
+        marks = input_watermarks(self._factor, dates)
+        self.logger.info(f'compute factor at {len(dates)} dates: ' + ', '.join(f'{dt:%Y-%m-%d}' for dt in dates[:3])
+                         + (', ...' if len(dates) > 3 else ''))
+        snapshots = self._factor.compute_range(dates)
+        for dt, data in snapshots.items():
+            if data.empty:
+                self.logger.warning(f'empty data at {dt:%Y-%m-%d} need to be check!')
+        deleted, inserted = self.write_snapshots(snapshots)
+        save_watermarks(self.key, marks)
+        self.logger.info(f'replace {len(snapshots)} dates of {self.key}: delete {deleted}, insert {inserted}')
+
+    def localized_time_series(self, start=None, end=None, freq=FreqEnum.M, if_exist=1, batch_size=12,
+                              n_jobs=1, max_retry=2):
+        """
+        计算并保存时间序列
+
+        :param n_jobs: number of worker processes; if greater than 1, dates are computed in parallel
+            and results are written by this process in batches of `batch_size`
+        :param max_retry: times to retry a failed date in parallel mode
+        :return: list of dates failed after retry in parallel mode, always empty in serial mode which raises instead
+        """
+        if n_jobs <= 1:
+            super().localized_time_series(start, end, freq, if_exist, batch_size)
+            return []
+
+        dates = [*self.get_calc_dates(start, end, freq)]
+        if if_exist != 1:
+            exist = self.exist_dates(dates)
+            if exist:
+                msg = f"factor data at {exist[0]:%Y-%m-%d} is exist, please turn into replace mode or check your code!"
+                raise DataExistError(msg)
+        return self._parallel_backfill(dates, batch_size, n_jobs, max_retry)
+
+    def _parallel_backfill(self, dates, batch_size, n_jobs, max_retry):
+        # connections of the shared engine must not be inherited by forked workers.
+        configure_engine()
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+
+        marks = input_watermarks(self._factor, dates)
+        todo, tries, running = deque(dates), Counter(), dict()
+        pending, failed, n_done, tic = dict(), [], 0, time.time()
+
+        def _new_pool():
+            return ProcessPoolExecutor(n_jobs, mp_context=context, initializer=_init_worker, initargs=(self._factor,))
+
+        def _retry(dt, e):
+            tries[dt] += 1
+            if tries[dt] <= max_retry:
+                self.logger.warning(f'retry factor at {dt:%Y-%m-%d} after {e!r}')
+                todo.append(dt)
+            else:
+                self.logger.error(f'fail to compute factor at {dt:%Y-%m-%d} with {e!r}')
+                failed.append(dt)
+
+        pool = _new_pool()
+        try:
+            while todo or running:
+                # at most two dates queued for each worker, so finished snapshots do not pile up in memory.
+                broken = False
+                while todo and len(running) < n_jobs * 2:
+                    try:
+                        future = pool.submit(_compute_in_worker, todo[0])
+                    except BrokenProcessPool:
+                        broken = True
+                        break
+                    running[future] = todo.popleft()
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED) if running else (set(), set())
+                for future in finished:
+                    dt = running.pop(future)
+                    try:
+                        pending[dt] = future.result()
+                    except BrokenProcessPool as e:
+                        broken = True
+                        _retry(dt, e)
+                        continue
+                    except Exception as e:
+                        _retry(dt, e)
+                        continue
+                    n_done += 1
+                    if pending[dt].empty:
+                        self.logger.warning(f'empty data at {dt:%Y-%m-%d} need to be check!')
+
+                if broken:
+                    # a worker died (e.g. killed for memory), the pool is unusable and the crashed date is unknown,
+                    # so every date in flight counts a try.
+                    for dt in running.values():
+                        _retry(dt, BrokenProcessPool('worker process terminated abruptly'))
+                    running.clear()
+                    pool.shutdown(wait=False)
+                    pool = _new_pool()
+
+                if pending and (len(pending) >= batch_size or not (todo or running)):
+                    self.write_snapshots(pending)
+                    save_watermarks(self.key, marks.loc[[*pending.keys()]])
+                    pending = dict()
+                    elapsed = time.time() - tic
+                    eta = elapsed / max(n_done, 1) * (len(dates) - n_done - len(failed))
+                    self.logger.info(f'{n_done}/{len(dates)} dates saved in {elapsed:.0f}s, eta {eta:.0f}s')
+        finally:
+            pool.shutdown()
+
+        if failed:
+            self.logger.error(f'{len(failed)} dates failed: {", ".join(f"{t:%Y-%m-%d}" for t in failed)}')
+        return failed
+
+    def stale_dates(self, start=None, end=None, freq=FreqEnum.M):
+        """
+        需要重新计算的日期: 没有数据的新日期, 及数据源在计算窗口内有新写入的日期.
+        已有数据但没有水位记录的日期视为最新, 记录当前水位.
+        因子没有声明 `inputs` 时, 从最后一个已有日期开始重新计算.
+
+        :return: DatetimeIndex
+        """
+        if not self._factor.inputs:
+            return pd.DatetimeIndex([*self.get_calc_dates(self.get_max_date(), end, freq)])
+
+        dates = pd.DatetimeIndex([*self.get_calc_dates(start, end, freq)])
+        exist = pd.DatetimeIndex(self.exist_dates(dates))
+        current = input_watermarks(self._factor, exist)
+        saved = saved_watermarks(self.key, exist).reindex(columns=current.columns)
+        unknown = saved.isna().all(axis=1).values
+        if unknown.any():
+            self.logger.info(f'record current watermarks for {unknown.sum()} dates without watermark')
+            save_watermarks(self.key, current.loc[unknown])
+        changed = (current.ne(saved) & (current.notna() | saved.notna())).any(axis=1).values & ~unknown
+        return dates.difference(exist).union(exist[changed])
+
+    def localized_stale(self, start=None, end=None, freq=FreqEnum.M, batch_size=12, n_jobs=1, max_retry=2):
+        """
+        只计算 `stale_dates`, 参数见 `localized_time_series`
+        """
+        dates = self.stale_dates(start, end, freq)
+        self.logger.info(f'{dates.size} stale dates to compute')
+        if n_jobs > 1:
+            return self._parallel_backfill([*dates], batch_size, n_jobs, max_retry)
+        for i in range(0, dates.size, batch_size):
+            self.localized_snapshots(dates[i:i + batch_size])
+        return []
+
+    def get_calc_dates(self, start, end, freq):
+        calendar = get_calendar()
+        # real start date
+        real_start = self._factor.start_date
+        if start is not None and pd.notna(calendar.prev(start, freq)):
+            real_start = max((calendar.prev(start, freq), real_start))
+        # real end date
+        real_end = min((get_last_td(), pd.Timestamp(end) if end is not None else pd.Timestamp.max))
+        # final
+        return iter(calendar.range(real_start, real_end, freq))
+
+
+class FactorDBTool(_FactorIO):
     __sql_mapping = {float: sa.Float, str: sa.String(100), int: sa.Integer, np.datetime64: sa.Date}
 
     def __init__(self, factor: 'AbstractFactor'):
@@ -55,50 +279,49 @@ class FactorDBTool(AbstractFactorIO):
             )
         return self.__table
 
-    def localized_snapshot(self, dt, if_exist=1):
-        """
-        计算并保存单日因子
-        """
-        # check if data exist
+    def exist_dates(self, dates):
         with get_session() as session:
-            filters = [self.table.c.trade_dt == dt]
-            if if_exist == 1:
-                res = session.execute(sa.delete(self.table).where(*filters))
-                try_commit(
-                    session, 'delete exist factor values',
-                    f'delete {res.rowcount} from {self.table.key}' if res.rowcount else ''
-                )
-            elif session.query(self.table).filter(*filters).first():
-                msg = f"factor data at {dt:%Y-%m-%d} is exist, please turn into replace mode or check your code!"
-                raise DataExistError(msg)
+            exist = session.query(self.table.c.trade_dt).filter(
+                self.table.c.trade_dt == sa.any_(sa.literal([pd.Timestamp(t).date() for t in dates], pg.ARRAY(sa.Date)))
+            ).distinct().all()
+        return sorted(pd.Timestamp(t) for (t,) in exist)
 
-        self.logger.info(f'compute factor at {dt:%Y-%m-%d}')
-        snapshot = self._factor.compute(dt)
-        if snapshot.empty:
-            self.logger.warning(f'empty data at {dt:%Y-%m-%d} need to be check!')
-        else:
-            snapshot.index.name = 'wind_code'
-            bulk_insert(snapshot.reset_index().assign(trade_dt=dt), self.table)
+    def write_snapshots(self, snapshots):
+        """ 在一个事务内替换多个日期的截面 """
+        frames = [
+            snapshot.rename_axis('wind_code').reset_index().assign(trade_dt=dt)
+            for dt, snapshot in snapshots.items() if not snapshot.empty
+        ]
+        data = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['wind_code', 'trade_dt'])
+        return replace_dates(data, self.table, dates=[*snapshots.keys()])
 
     def fetch_snapshot(self, dt):
-        with get_session() as session:
-            snapshot = pd.DataFrame(
-                session.query(
-                    *(self.table.c[col] for col in (*self._factor.field_types.keys(), 'wind_code'))
-                ).filter(self.table.c.trade_dt == dt).all()
-            ).fillna(np.nan)
+        snapshot = fetch_frame(
+            sa.select([self.table.c[col] for col in (*self._factor.field_types.keys(), 'wind_code')]).where(
+                self.table.c.trade_dt == dt
+            )
+        )
         return snapshot.set_index('wind_code').astype(self._factor.field_types, errors='ignore')
 
-    def get_calc_dates(self, start, end, freq):
-        # real start date
-        if start is None:
-            real_start = self._factor.start_date
-        else:
-            real_start = max((t for t in get_dates(freq) if self._factor.start_date <= t <= pd.Timestamp(start)))
-        # real end date
-        real_end = min((get_last_td(), pd.Timestamp(end) if end is not None else pd.Timestamp.max))
-        # final
-        return (t for t in get_dates(freq) if real_start <= t <= real_end)
+    def fetch_range(self, start=None, end=None, dates=None, fields=None, as_panel=False):
+        """ 一次查询读取多个日期的截面, 参数见 `AbstractFactorIO.fetch_range` """
+        fields = [*(fields or self._factor.field_types.keys())]
+        query = sa.select([self.table.c.trade_dt, self.table.c.wind_code, *(self.table.c[col] for col in fields)])
+        if dates is not None:
+            dates = pd.DatetimeIndex(dates)
+            if dates.empty:
+                return super().fetch_range(dates=dates, fields=fields, as_panel=as_panel)
+            start = max(pd.Timestamp(start), dates.min()) if start is not None else dates.min()
+            end = min(pd.Timestamp(end), dates.max()) if end is not None else dates.max()
+            query = query.where(self.table.c.trade_dt == sa.any_(sa.literal([t.date() for t in dates], pg.ARRAY(sa.Date))))
+        if start is not None:
+            query = query.where(self.table.c.trade_dt >= start)
+        if end is not None:
+            query = query.where(self.table.c.trade_dt <= end)
+
+        data = fetch_frame(query).set_index(['trade_dt', 'wind_code']).sort_index()
+        data = data.astype({k: v for k, v in self._factor.field_types.items() if k in fields}, errors='ignore')
+        return self.to_panels(data) if as_panel else data
 
     def get_max_date(self):
         with get_session() as ss:
@@ -106,3 +329,115 @@ class FactorDBTool(AbstractFactorIO):
                 ss.query(sa.func.max(self.table.c.trade_dt).label('max_dt'))
             ).squeeze())
         return max_dt
+
+
+class ParquetFactorIO(_FactorIO):
+    """
+    因子保存为本地parquet(需要pyarrow), 每个日期一个文件, 按日期选择文件后只读取需要的列::
+
+        {local_store}/factor/{key}/20200131.parquet
+
+    单个日期的替换是原子的, 多个日期之间没有事务.
+    """
+
+    def __init__(self, factor: 'AbstractFactor'):
+        super().__init__(factor)
+        self.root = get_local_path('factor', self.key)
+
+    def _path(self, dt):
+        return self.root.joinpath(f'{pd.Timestamp(dt):%Y%m%d}.parquet')
+
+    def _dates(self):
+        return pd.DatetimeIndex(sorted(pd.to_datetime(p.stem, format='%Y%m%d') for p in self.root.glob('*.parquet')))
+
+    def _empty(self, fields):
+        return pd.DataFrame(columns=fields, index=pd.Index([], name='wind_code'))
+
+    def exist_dates(self, dates):
+        return [pd.Timestamp(t) for t in dates if self._path(t).exists()]
+
+    def write_snapshots(self, snapshots):
+        self.root.mkdir(parents=True, exist_ok=True)
+        deleted, inserted = 0, 0
+        for dt, snapshot in snapshots.items():
+            path = self._path(dt)
+            if path.exists():
+                deleted += pd.read_parquet(path, columns=['wind_code']).shape[0]
+            if snapshot.empty:
+                path.unlink(missing_ok=True)
+                continue
+            data = snapshot.filter(self._factor.field_types.keys(), axis=1).astype(self._factor.field_types, errors='ignore')
+            tmp = path.with_suffix('.tmp')
+            data.rename_axis('wind_code').reset_index().to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+            inserted += data.shape[0]
+        return deleted, inserted
+
+    def fetch_snapshot(self, dt):
+        path = self._path(dt)
+        if not path.exists():
+            return self._empty([*self._factor.field_types.keys()])
+        return pd.read_parquet(path).set_index('wind_code').astype(self._factor.field_types, errors='ignore')
+
+    def fetch_range(self, start=None, end=None, dates=None, fields=None, as_panel=False):
+        """ 参数见 `AbstractFactorIO.fetch_range`, 只读取日期范围内的文件 """
+        fields = [*(fields or self._factor.field_types.keys())]
+        exist = self._dates()
+        if dates is not None:
+            exist = exist.intersection(pd.DatetimeIndex(dates))
+        if start is not None:
+            exist = exist[exist >= pd.Timestamp(start)]
+        if end is not None:
+            exist = exist[exist <= pd.Timestamp(end)]
+
+        frames = {dt: pd.read_parquet(self._path(dt), columns=['wind_code', *fields]).set_index('wind_code') for dt in exist}
+        if frames:
+            data = pd.concat(frames, names=['trade_dt', 'wind_code'])
+        else:
+            data = self._empty(fields).set_index(pd.MultiIndex.from_arrays([[], []], names=['trade_dt', 'wind_code']))
+        return self.to_panels(data) if as_panel else data
+
+    def get_max_date(self):
+        dates = self._dates()
+        return dates[-1] if dates.size else None
+
+
+_BACKENDS = {'db': FactorDBTool, 'parquet': ParquetFactorIO}
+
+
+def get_factor_io(factor: 'AbstractFactor') -> _FactorIO:
+    """
+    按配置选择因子存储, 配置文件 `[factor_io]` 中 `{key} = parquet` 指定单个因子, `default` 指定其余因子, 默认为数据库
+
+    :param factor: AbstractFactor
+    :return: FactorDBTool or ParquetFactorIO
+    """
+    key = _sql_name(factor)
+    backend = get_option('factor_io', key, fallback=get_option('factor_io', 'default', fallback='db'))
+    return _BACKENDS[backend](factor)
+
+
+def export_factor_table(factor: 'AbstractFactor', start=None, end=None, batch_size=60):
+    """
+    将数据库中的因子表导出为本地parquet, 已存在的日期被覆盖
+
+    :param factor: AbstractFactor
+    :param start: first date, default all
+    :param end: last date, default all
+    :param batch_size: dates of each read
+    :return: number of dates exported
+    """
+    source, target = FactorDBTool(factor), ParquetFactorIO(factor)
+    with get_session() as session:
+        query = session.query(source.table.c.trade_dt).distinct()
+        if start is not None:
+            query = query.filter(source.table.c.trade_dt >= start)
+        if end is not None:
+            query = query.filter(source.table.c.trade_dt <= end)
+        dates = sorted(pd.Timestamp(t) for (t,) in query.all())
+
+    for i in range(0, len(dates), batch_size):
+        data = source.fetch_range(dates=dates[i:i + batch_size])
+        target.write_snapshots({dt: df.droplevel('trade_dt') for dt, df in data.groupby(level='trade_dt')})
+        target.logger.info(f'export {source.key} until {dates[min(i + batch_size, len(dates)) - 1]:%Y-%m-%d}')
+    return len(dates)
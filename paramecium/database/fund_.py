@@ -9,17 +9,22 @@ import numpy as np
 import pandas as pd
 import sqlalchemy as sa
 from pandas.tseries.offsets import QuarterEnd
+from sqlalchemy.dialects import postgresql as pg
 
-from ._postgres import get_session
+from ._postgres import fetch_frame
 from ._tool import get_type_codes
-from .comment import get_sector, get_dates
+from ._universe import CachedUniverse
+from .calendar_ import get_calendar
+from .membership import get_sector_index
 from .pg_models import fund
 from .. import const
-from ..interface import AbstractUniverse
 
 
 @lru_cache(maxsize=4)
-class FundUniverse(AbstractUniverse):
+class FundUniverse(CachedUniverse):
+    # history of `trade_calendar` does not change, new trade dates are new cache dates anyway.
+    source_tables = ('mf_org_description', 'mf_org_connections', 'mf_org_convert')
+    dated_sources = {'mf_org_portfolio': 'end_date', 'mf_org_sector_m': 'trade_dt'}
 
     def __init__(self, include_=(),
                  # 定期开放,委外,机构,可转债
@@ -33,71 +38,81 @@ class FundUniverse(AbstractUniverse):
         self.size = size_
         self.manager = manager  # TODO
 
+    def _init_args(self):
+        return (self.include, self.exclude, self.initial_only, self.open_only, self.issue, self.size, self.manager)
+
     def __str__(self):
         mapping = get_type_codes('mf_org_sector_m')['sector_code']
-        include = ','.join(map(lambda x: mapping.get(x, x), self.include))
-        exclude = ','.join(map(lambda x: mapping.get(x, x), self.exclude))
+        include = ','.join(map(lambda x: mapping.get(x, x), self.include or ()))
+        exclude = ','.join(map(lambda x: mapping.get(x, x), self.exclude or ()))
         return (f"Fund(include=[{include}], exclude=[{exclude}], initial={self.initial_only}, open={self.open_only}, "
                 f"issue={self.issue}days), size={self.size}*1e8, manager={self.manager}days")
 
-    @lru_cache(maxsize=2)
-    def get_instruments(self, month_end):
-        issue_dt = [t for t in get_dates(const.FreqEnum.D) if t < month_end][-self.issue]
-        with get_session() as ss:
-            filters = [
-                # date
-                fund.Description.setup_date <= issue_dt,
-                fund.Description.redemption_start_dt <= month_end,
-                fund.Description.maturity_date >= month_end,
-                # not connect fund
-                fund.Description.wind_code.notin_(ss.query(fund.Connections.child_code)),
-                # issue reset after convert happened.
-                sa.not_(ss.query(fund.Converted.wind_code).filter(
-                    fund.Converted.chg_date > issue_dt,
-                    fund.Converted.chg_date <= month_end,
-                    fund.Converted.wind_code == fund.Description.wind_code
-                ).exists())
-            ]
-            if self.open_only:
-                filters.append(fund.Description.fund_type == '契约型开放式')
-            if self.initial_only:
-                filters.append(fund.Description.is_initial == 1)
-            if self.size > 0:
-                filters.append(ss.query(fund.PortfolioAsset.wind_code).filter(
-                    fund.PortfolioAsset.net_asset >= self.size * 1e8,
-                    fund.PortfolioAsset.end_date == (month_end - pd.Timedelta(days=22) - QuarterEnd()),
-                    fund.PortfolioAsset.wind_code == fund.Description.wind_code
-                ).exists())
-            # if self.manager:
-            #
-            fund_list = {code for (code,) in ss.query(fund.Description.wind_code).filter(*filters).all()}
+    def compute_range(self, month_ends):
+        calendar = get_calendar()
+        issue_dt = calendar.offset(calendar.prev(month_ends, strict=True), 1 - self.issue).values[:, None]
+        month_end = month_ends.values[:, None]
+
+        desc = fetch_frame(
+            sa.select([
+                fund.Description.wind_code, fund.Description.setup_date, fund.Description.redemption_start_dt,
+                fund.Description.maturity_date, fund.Description.fund_type, fund.Description.is_initial,
+            ]).where(fund.Description.wind_code.notin_(sa.select([fund.Connections.child_code])))
+        )
+        codes = pd.Index(desc['wind_code'])
+        universe = (
+                (desc['setup_date'].values[None, :] <= issue_dt)
+                & (desc['redemption_start_dt'].values[None, :] <= month_end)
+                & (desc['maturity_date'].values[None, :] >= month_end)
+        )
+        if self.open_only:
+            universe &= desc['fund_type'].eq('契约型开放式').values[None, :]
+        if self.initial_only:
+            universe &= desc['is_initial'].eq(1).values[None, :]
+
+        # issue reset after convert happened.
+        converted = fetch_frame(sa.select([fund.Converted.wind_code, fund.Converted.chg_date])).loc[
+            lambda df: df['wind_code'].isin(codes)]
+        chg_date = converted['chg_date'].values[None, :]
+        rows, cols = np.nonzero((chg_date > issue_dt) & (chg_date <= month_end))
+        universe[rows, codes.get_indexer(converted['wind_code'].values[cols])] = False
 
+        if self.size > 0:
+            report_dt = pd.DatetimeIndex([t - pd.Timedelta(days=22) - QuarterEnd() for t in month_ends])
+            sized = fetch_frame(sa.select([fund.PortfolioAsset.end_date, fund.PortfolioAsset.wind_code]).where(sa.and_(
+                fund.PortfolioAsset.net_asset >= self.size * 1e8,
+                fund.PortfolioAsset.end_date == sa.any_(sa.literal([t.date() for t in report_dt.unique()], pg.ARRAY(sa.Date))),
+            ))).loc[lambda df: df['wind_code'].isin(codes)]
+            has_size = np.zeros_like(universe)
+            for i, dt in enumerate(report_dt):
+                has_size[i, codes.get_indexer(sized.loc[sized['end_date'] == dt, 'wind_code'])] = True
+            universe &= has_size
+
+        universe = pd.DataFrame(universe, index=month_ends, columns=codes)
         if self.include or self.exclude:
-            sector_type = pd.concat((
-                get_sector(const.AssetEnum.CMF, valid_dt=month_end, sector_prefix='2001'),
-                get_sector(
-                    const.AssetEnum.CMF, sector_prefix='1000',
-                    valid_dt=max((t for t in get_dates(const.FreqEnum.Q) if t < month_end)),
-                ),
-            ))
+            quarter_end = calendar.prev(month_ends, const.FreqEnum.Q, strict=True)
+
+            def _in_sector(labels):
+                by_type = get_sector_index(const.AssetEnum.CMF, '2001').contains(month_ends, labels=labels)
+                by_share = get_sector_index(const.AssetEnum.CMF, '1000').contains(quarter_end.dropna(), labels=labels)
+                by_share = by_share.reindex(index=quarter_end, columns=codes, fill_value=False).set_axis(month_ends, axis=0)
+                return by_type.reindex(columns=codes, fill_value=False) | by_share
+
             if self.include:
-                in_fund = sector_type.loc[lambda df: df['sector_code'].isin(self.include), 'wind_code']
-                fund_list = fund_list & {*in_fund}
+                universe &= _in_sector(self.include)
             if self.exclude:
-                ex_fund = sector_type.loc[lambda df: df['sector_code'].isin(self.exclude), 'wind_code']
-                fund_list = fund_list - {*ex_fund}
+                universe &= ~_in_sector(self.exclude)
 
-        return fund_list
+        return universe
 
 
 def get_convert_fund(valid_dt):
-    with get_session() as ss:
-        query = pd.DataFrame(
-            ss.query(
-                fund.Converted.wind_code,
-                fund.Converted.chg_date,
-                fund.Converted.ann_date,
-                fund.Converted.memo
-            ).filter(fund.Converted.chg_date <= valid_dt).all()
-        ).set_index('wind_code').fillna(np.nan)
-    return query
+    query = fetch_frame(
+        sa.select([
+            fund.Converted.wind_code,
+            fund.Converted.chg_date,
+            fund.Converted.ann_date,
+            fund.Converted.memo
+        ]).where(fund.Converted.chg_date <= valid_dt)
+    )
+    return query.set_index('wind_code')
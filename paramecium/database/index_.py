@@ -9,18 +9,26 @@ from itertools import product
 
 import pandas as pd
 
+from ._memo import disk_memo
+from .calendar_ import get_calendar
 from .comment import get_price, get_risk_free_rates, get_dates
 from .. import const
 
 
+# tables behind index factor series: index prices, trade calendar and risk-free rates.
+_INDEX_SOURCES = ('index_org_price', 'index_derivative_price', 'trade_calendar', 'macro_interest_rate')
+
+
 def _get_index_price(code):
     price = get_price(const.AssetEnum.INDEX, code=code)
     return price.set_index('trade_dt').loc[lambda ser: ~ser.index.duplicated(), 'close_']
 
 
 def _resample_ret(price, freq):
-    mapper = get_dates(freq).to_series().resample('D').bfill()
-    return price.rename(index=mapper).loc[lambda ser: ~ser.index.duplicated()].pct_change(1)
+    # label each date by its period end, dates after the last period end keep their own label.
+    labels = get_calendar().period_end(price.index, freq)
+    labels = labels.where(labels.notna(), pd.DatetimeIndex(price.index))
+    return price.set_axis(labels, axis=0).loc[lambda ser: ~ser.index.duplicated()].pct_change(1)
 
 
 def calc_market_factor(code_or_price, calc_freq=const.FreqEnum.W):
@@ -86,6 +94,7 @@ def calc_timing_factor(code_or_price, method='gii', calc_freq=const.FreqEnum.W):
         raise KeyError(f"Unknown `method` {method}.")
 
 
+@disk_memo(tables=_INDEX_SOURCES)
 def get_index_ff3(calc_freq=const.FreqEnum.W, timing=None):
     market_price = _get_index_price('h00985.CSI')
 
@@ -103,6 +112,7 @@ def get_index_ff3(calc_freq=const.FreqEnum.W, timing=None):
     return factors
 
 
+@disk_memo(tables=_INDEX_SOURCES)
 def get_index_bond5(calc_freq=const.FreqEnum.W):
     bond_market = _get_index_price('CBA00301.CS')
     credit_3a = _get_index_price('CBA04201.CS')
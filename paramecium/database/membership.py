@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+板块/曾用名等区间成员关系的内存索引, 一次查询多个日期, 结果为 日期×代码 矩阵.
+"""
+__all__ = ['IntervalIndex', 'get_sector_index', 'get_name_index', 'refresh_membership']
+
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+from ._postgres import get_or_create_table, fetch_frame
+from .pg_models import fund, stock
+from ..const import AssetEnum
+
+
+class IntervalIndex(object):
+    """
+    区间成员索引, 每条记录表示 `code` 在 [entry_dt, remove_dt] 内属于 `label`,
+    entry_dt 为空视为一直有效, remove_dt 为空视为至今有效.
+    """
+
+    def __init__(self, codes, labels, entry_dt, remove_dt):
+        self._codes = pd.Categorical(codes)
+        self._labels = pd.Categorical(labels)
+        self._entry = pd.DatetimeIndex(entry_dt).fillna(pd.Timestamp.min).values
+        self._remove = pd.DatetimeIndex(remove_dt).fillna(pd.Timestamp.max).values
+
+    def __len__(self):
+        return len(self._codes)
+
+    @classmethod
+    def from_frame(cls, data, code_col='wind_code', label_col='sector_code', entry_col='entry_dt', remove_col='remove_dt'):
+        return cls(data[code_col], data[label_col], data[entry_col], data[remove_col])
+
+    @property
+    def codes(self):
+        return pd.Index(self._codes.categories)
+
+    def _select(self, labels=None, prefix=None, pattern=None):
+        """ rows whose label matches all given conditions """
+        cats = pd.Series(self._labels.categories)
+        matched = pd.Series(True, index=cats.index)
+        if labels is not None:
+            matched &= cats.isin([*labels])
+        if prefix is not None:
+            matched &= cats.str.startswith(prefix)
+        if pattern is not None:
+            matched &= cats.str.contains(pattern, regex=True)
+        return matched.values[self._labels.codes] & (self._labels.codes >= 0)
+
+    def _spans(self, dates, rows):
+        """ for each row, positions [start, stop) of sorted `dates` inside its interval """
+        values = dates.values
+        return (values.searchsorted(self._entry[rows], side='left'),
+                values.searchsorted(self._remove[rows], side='right'))
+
+    def contains(self, dates, labels=None, prefix=None, pattern=None):
+        """
+        各日期各代码是否属于匹配的板块
+
+        :param dates: array of dates
+        :param labels: label list
+        :param prefix: label prefix
+        :param pattern: regex of label
+        :return: DataFrame of bool, index is sorted dates and columns are all codes
+        """
+        dates = pd.DatetimeIndex(dates).unique().sort_values()
+        rows = np.flatnonzero(self._select(labels, prefix, pattern))
+        start, stop = self._spans(dates, rows)
+        cols = self._codes.codes[rows]
+
+        # +1 at entry and -1 after remove, cumulative sum is the number of matched intervals on each date.
+        counter = np.zeros((dates.size + 1, len(self._codes.categories)), dtype=np.int32)
+        np.add.at(counter, (start, cols), 1)
+        np.add.at(counter, (stop, cols), -1)
+        return pd.DataFrame(counter.cumsum(axis=0)[:-1] > 0, index=dates, columns=self.codes)
+
+    def members(self, dt, labels=None, prefix=None, pattern=None):
+        """ 单个日期的成员, set of codes """
+        flags = self.contains([dt], labels, prefix, pattern).iloc[0]
+        return {*flags.index[flags.values]}
+
+    def labels(self, dates, labels=None, prefix=None, pattern=None):
+        """
+        各日期各代码所属板块, 同时属于多个板块时取进入日期最晚的一个
+
+        :return: DataFrame of category, NaN if not in any matched label
+        """
+        dates = pd.DatetimeIndex(dates).unique().sort_values()
+        rows = np.flatnonzero(self._select(labels, prefix, pattern))
+        rows = rows[np.argsort(self._entry[rows], kind='stable')]
+        start, stop = self._spans(dates, rows)
+
+        result = np.full((dates.size, len(self._codes.categories)), -1, dtype=np.int32)
+        for row, lo, hi in zip(rows, start, stop):
+            result[lo:hi, self._codes.codes[row]] = self._labels.codes[row]
+        return pd.DataFrame({
+            code: pd.Categorical.from_codes(result[:, i], categories=self._labels.categories)
+            for i, code in enumerate(self.codes)
+        }, index=dates)
+
+
+@lru_cache()
+def get_sector_index(asset: AssetEnum, group=None) -> IntervalIndex:
+    """
+    板块成员索引, 进程内缓存, 数据更新后调用 `refresh_membership`
+
+    :param asset: AssetEnum.STOCK from `stock_org_sector`,
+        AssetEnum.CMF from monthly snapshot `mf_org_sector_m`, each snapshot is valid on its `trade_dt` only.
+    :param group: `type_` of fund sector snapshot, such as `2001` or `1000`
+    """
+    if asset == AssetEnum.STOCK:
+        model = get_or_create_table('stock_org_sector')
+        data = fetch_frame(sa.select([model.c.wind_code, model.c.sector_code, model.c.entry_dt, model.c.remove_dt]))
+        return IntervalIndex.from_frame(data)
+    elif asset == AssetEnum.CMF:
+        model = fund.SectorSnapshot.__table__
+        query = sa.select([model.c.wind_code, model.c.sector_code, model.c.trade_dt])
+        if group is not None:
+            query = query.where(model.c.type_ == group)
+        data = fetch_frame(query)
+        return IntervalIndex.from_frame(data, entry_col='trade_dt', remove_col='trade_dt')
+    else:
+        raise KeyError(f"Unknown asset type {asset}.")
+
+
+@lru_cache()
+def get_name_index() -> IntervalIndex:
+    """ A股曾用名索引, label 为名称 """
+    model = stock.ASharePreviousName.__table__
+    data = fetch_frame(sa.select([model.c.wind_code, model.c.use_name, model.c.entry_dt, model.c.remove_dt]))
+    return IntervalIndex.from_frame(data, label_col='use_name')
+
+
+def refresh_membership():
+    """ 清除缓存, 下次使用时重新读取 """
+    get_sector_index.cache_clear()
+    get_name_index.cache_clear()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+日期×代码的行情面板, 进程内按 (asset, field, adjust) 缓存一张连续区间的面板,
+区间外的请求只补读缺少的部分, 各截面均为同一面板的切片.
+数据源表有新写入(`source_token` 变化)后, 该资产的缓存整体丢弃.
+"""
+__all__ = ['get_panel', 'get_return_panel', 'clear_panel_cache']
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+from ._memo import source_token
+from .calendar_ import get_calendar
+from .comment import get_price, get_last_td
+from .price_store import sample_windows, get_price_store
+from ..const import AssetEnum, FreqEnum
+
+_PRICE_FIELD = {AssetEnum.STOCK: 'close_', AssetEnum.CMF: 'unit_nav', AssetEnum.INDEX: 'close_'}
+_ADJUSTABLE = (AssetEnum.STOCK, AssetEnum.CMF)
+_MIN_EXTEND = pd.Timedelta(days=365)  # load at least one year each time, so that rolling calls rarely miss
+
+_panels = dict()  # (asset, field, adjust) -> (start, end, DataFrame)
+_samples = dict()  # (asset, field, adjust, asof) -> (DataFrame, Series of window lower bound by sample date)
+_tokens = dict()  # asset -> source token when its panels were cached
+_lock = threading.RLock()
+
+
+def _check_source(asset):
+    """ drop cached panels of `asset` if its source tables are written after they were cached """
+    token = source_token(get_price_store(asset).sources)
+    with _lock:
+        if _tokens.get(asset) != token:
+            for cache in (_panels, _samples):
+                for key in [k for k in cache if k[0] == asset]:
+                    cache.pop(key)
+            _tokens[asset] = token
+
+
+def _load(asset, field, adjust, start=None, end=None, dates=None, asof=False):
+    """ read prices in [start, end] or at `dates`, and pivot into trade_dt x wind_code """
+    adjust = adjust and asset in _ADJUSTABLE
+    price = get_price(
+        asset, start=start, end=end, fields=[field, 'adj_factor'] if adjust else [field], dates=dates, asof=asof
+    )
+    # duplicated rows are possible before `clean_duplicates`, the later one in the result of `get_price` wins.
+    price = price.drop_duplicates(['trade_dt', 'wind_code'], keep='last')
+    values = price[field].astype(float)
+    if adjust:
+        values = values * price['adj_factor']
+
+    dates = pd.DatetimeIndex(price['trade_dt'].unique()).sort_values()
+    codes = pd.Index(price['wind_code'].unique()).sort_values()
+    panel = np.full((dates.size, codes.size), np.nan)
+    panel[dates.get_indexer(price['trade_dt']), codes.get_indexer(price['wind_code'])] = values.values
+    return pd.DataFrame(panel, index=dates, columns=codes)
+
+
+def _get_cached(asset, field, adjust, start, end):
+    key = (asset, field, adjust)
+    last_td = get_last_td()
+    with _lock:
+        if key not in _panels:
+            hi = max(end, min(start + _MIN_EXTEND, last_td))
+            _panels[key] = (start, hi, _load(asset, field, adjust, start, hi))
+            return _panels[key][2]
+
+        lo, hi, frame = _panels[key]
+        parts = [frame]
+        if start < lo:
+            new_lo = min(start, lo - _MIN_EXTEND)
+            parts.insert(0, _load(asset, field, adjust, new_lo, lo - pd.Timedelta(days=1)))
+            lo = new_lo
+        if end > hi:
+            new_hi = max(end, min(hi + _MIN_EXTEND, last_td))
+            parts.append(_load(asset, field, adjust, hi + pd.Timedelta(days=1), new_hi))
+            hi = new_hi
+        if len(parts) > 1:
+            frame = pd.concat(parts, axis=0)
+            _panels[key] = (lo, hi, frame)
+        return frame
+
+
+def _get_sampled(asset, field, adjust, asof, dates):
+    """ sampled rows are cached by date, only dates not fetched before (or with another as-of window) are read """
+    key = (asset, field, adjust, asof)
+    lo, hi = sample_windows(dates)
+    with _lock:
+        frame, bounds = _samples.get(key, (pd.DataFrame(), pd.Series(dtype='datetime64[ns]')))
+        todo = [(t, b) for t, b in zip(hi, lo) if t not in bounds.index or (asof and bounds[t] != b)]
+        if todo:
+            missing = pd.DatetimeIndex([t for t, _ in todo])
+            # as-of window of a date is bounded by the previous sample date, so fetch that date as well.
+            fetch = sorted({*missing, *(b for _, b in todo)}) if asof else missing
+            new = _load(asset, field, adjust, dates=fetch, asof=asof).reindex(index=missing)
+            new_bounds = pd.Series([b for _, b in todo], index=missing)
+            if not frame.empty:
+                new = pd.concat([frame.drop(index=missing, errors='ignore'), new], axis=0)
+                new_bounds = pd.concat([bounds.drop(index=missing, errors='ignore'), new_bounds])
+            frame, bounds = new, new_bounds
+            _samples[key] = (frame, bounds)
+    return frame.reindex(index=hi)
+
+
+def get_panel(asset: AssetEnum, field=None, dates=None, codes=None, adjust=True, start=None, end=None, asof=False):
+    """
+    行情面板
+
+    :param asset: AssetEnum
+    :param field: price field, default `close_` for stock and index, `unit_nav` for fund
+    :param dates: sample at these dates only, rows without data are NaN; default all trade dates in [start, end].
+        Only the sampled dates are read from database unless the cached daily panel covers them already.
+    :param codes: fixed columns, codes without data are NaN; default all codes with data
+    :param adjust: multiply by `adj_factor` if the asset has one
+    :param start: used when `dates` is None, default first trade date
+    :param end: used when `dates` is None, default last trade date
+    :param asof: used with `dates`, take the last value after the previous sample date if missing on a sample date
+    :return: DataFrame of float, index is trade_dt and columns are wind_code
+    """
+    field = field or _PRICE_FIELD[asset]
+    _check_source(asset)
+    if dates is not None:
+        dates = pd.DatetimeIndex(dates)
+        cached = _panels.get((asset, field, adjust))
+        if not asof and cached is not None and cached[0] <= dates.min() and dates.max() <= cached[1]:
+            frame = cached[2].reindex(index=dates)
+        else:
+            frame = _get_sampled(asset, field, adjust, asof, dates).reindex(index=dates)
+    else:
+        start = pd.Timestamp(start) if start is not None else get_calendar().dates()[0]
+        end = pd.Timestamp(end) if end is not None else get_last_td()
+        frame = _get_cached(asset, field, adjust, start, end).loc[start:end]
+    if codes is not None:
+        frame = frame.reindex(columns=pd.Index(codes))
+    return frame
+
+
+def get_return_panel(asset: AssetEnum, freq=FreqEnum.D, dates=None, codes=None, start=None, end=None):
+    """
+    收益率面板, 相邻两个采样日之间的复权收益
+
+    :param asset: AssetEnum
+    :param freq: FreqEnum, sample at trade dates of this frequency when `dates` is None
+    :param dates: sample dates
+    :param codes: fixed columns
+    :param start: first sample date, its row is dropped since it has no return
+    :param end: last sample date
+    :return: DataFrame of float, index is the end of each period
+    """
+    if dates is None:
+        dates = get_calendar().range(start, end if end is not None else get_last_td(), freq)
+    price = get_panel(asset, dates=dates, codes=codes)
+    return price.pct_change(fill_method=None).iloc[1:]
+
+
+def clear_panel_cache():
+    with _lock:
+        _panels.clear()
+        _samples.clear()
+        _tokens.clear()
@@ -4,15 +4,29 @@
 @Author: Sue Zhu
 """
 __all__ = [
-    'BaseORM', 'gen_oid', 'gen_update',
+    'BaseORM', 'gen_oid', 'gen_update', 'price_indexes',
     'AbstractDesc', 'AbstractPrice', 'AbstractSector'
 ]
 
 import sqlalchemy as sa
+from sqlalchemy.ext.declarative import declared_attr
 
 from .._postgres import BaseORM, gen_oid, gen_update
 
 
+def price_indexes(tablename):
+    """
+    行情表索引: 单日全市场查询用 (trade_dt, wind_code), 单代码区间查询用 (wind_code, trade_dt),
+    `trade_dt` 另建BRIN索引, 供 `max(trade_dt)` 及大区间扫描使用, `updated_at` 用于本地行情库的增量同步.
+    """
+    return (
+        sa.Index(f'ix_{tablename}_dt_code', 'trade_dt', 'wind_code'),
+        sa.Index(f'ix_{tablename}_code_dt', 'wind_code', 'trade_dt'),
+        sa.Index(f'brin_{tablename}_dt', 'trade_dt', postgresql_using='brin'),
+        sa.Index(f'ix_{tablename}_updated', 'updated_at'),
+    )
+
+
 class AbstractDesc(BaseORM):
     __abstract__ = True
 
@@ -25,10 +39,14 @@ class AbstractPrice(BaseORM):
     __abstract__ = True
 
     oid = gen_oid()
-    wind_code = sa.Column(sa.String(40), index=True, comment='证券代码')
-    trade_dt = sa.Column(sa.Date, index=True, comment='交易日期')
+    wind_code = sa.Column(sa.String(40), comment='证券代码')
+    trade_dt = sa.Column(sa.Date, comment='交易日期')
     close_ = sa.Column(sa.Float, comment='收盘价(元)')
 
+    @declared_attr
+    def __table_args__(cls):
+        return price_indexes(cls.__tablename__)
+
 
 class AbstractSector(BaseORM):
     __abstract__ = True
@@ -62,11 +62,12 @@ class WebSaleList(BaseORM):
 
 class Nav(BaseORM):
     __tablename__ = 'mf_org_nav'
+    __table_args__ = price_indexes(__tablename__)
 
     oid = gen_oid()
-    wind_code = sa.Column(sa.String(40), index=True)
+    wind_code = sa.Column(sa.String(40))
     ann_date = sa.Column(sa.Date)
-    trade_dt = sa.Column(sa.Date, index=True)
+    trade_dt = sa.Column(sa.Date)
     unit_nav = sa.Column(sa.Float)
     acc_nav = sa.Column(sa.Float)
     adj_factor = sa.Column(sa.Float)
@@ -17,3 +17,17 @@ class FundFactorList(BaseORM):
     params = sa.Column(pg.JSONB)
     calc_freq = sa.Column(sa.String(1), index=True)
     status = sa.Column(sa.Integer, server_default=sa.text('1'), index=True)
+
+
+class FactorWatermark(BaseORM):
+    """
+    因子各日期计算时, 各数据源在计算窗口内的 `max(updated_at)`
+    """
+    __tablename__ = 'monitor_factor_watermark'
+    __table_args__ = (sa.UniqueConstraint('target_table', 'trade_dt', 'source', name=f"uk_{__tablename__}"),)
+
+    oid = gen_oid()
+    target_table = sa.Column(sa.String(100), index=True)
+    trade_dt = sa.Column(sa.Date)
+    source = sa.Column(sa.String(100))
+    watermark = sa.Column(sa.TIMESTAMP)
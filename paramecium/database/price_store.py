@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+本地行情库, 按年分文件保存为parquet(需要pyarrow), 以 `updated_at` 为水位从数据库增量同步.
+增量同步看不到数据库中删除的行, `sync(check_deletes=True)` 时某年的行数少于本地则整年重新读取.
+
+目录结构::
+
+    {local_store}/price/{asset}/2020.parquet
+    {local_store}/price/{asset}/meta.json  # 各数据源的水位及同步时间
+"""
+__all__ = ['PriceStore', 'get_price_store', 'sample_windows']
+
+import json
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+
+import pandas as pd
+import sqlalchemy as sa
+
+from ._postgres import get_session, get_or_create_table, iter_frames
+from ..configuration import get_local_path
+from ..const import AssetEnum
+
+logger = logging.getLogger(__name__)
+
+# source tables of each asset, index price comes from view `index_price` which has no `updated_at`.
+_SOURCES = {
+    AssetEnum.STOCK: ('stock_org_price',),
+    AssetEnum.CMF: ('mf_org_nav',),
+    AssetEnum.INDEX: ('index_org_price', 'index_derivative_price'),
+}
+_INDEX_FIELDS = ('wind_code', 'trade_dt', 'close_')
+_KEYS = ['wind_code', 'trade_dt']
+
+
+def sample_windows(dates):
+    """
+    采样日的as-of区间 (lo, hi], 下界为前一个采样日, 第一个区间与第二个等长(仅一个采样日时只含当天)
+
+    :param dates: sample dates
+    :return: tuple of DatetimeIndex (lo, hi), hi is sorted unique sample dates, both empty if `dates` is empty
+    """
+    hi = pd.DatetimeIndex(dates).unique().sort_values()
+    if hi.empty:
+        return hi, hi
+    first = hi[0] - (hi[1] - hi[0] if hi.size > 1 else pd.Timedelta(days=1))
+    return pd.DatetimeIndex([first, *hi[:-1]]), hi
+
+
+class PriceStore(object):
+    """
+    单个资产的本地行情
+
+    :param asset: AssetEnum
+    :param overlap: rows updated within this period before the watermark are synced again,
+        since `updated_at` is the start time of a transaction that may commit later.
+    :param check_interval: seconds to cache the result of `is_fresh`
+    """
+
+    def __init__(self, asset: AssetEnum, overlap=pd.Timedelta(hours=1), check_interval=60):
+        self.asset = asset
+        self.root = get_local_path('price', asset.value)
+        self.overlap = overlap
+        self.check_interval = check_interval
+        self._fresh = (0, False)  # (checked at, result)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'PriceStore({self.asset.name}, {self.root})'
+
+    @property
+    def sources(self):
+        """ source tables in database """
+        return _SOURCES[self.asset]
+
+    # ---- meta -------------------------------------
+    @property
+    def _meta_path(self):
+        return self.root.joinpath('meta.json')
+
+    def read_meta(self):
+        if not self._meta_path.exists():
+            return {'watermarks': {}, 'synced_at': None}
+        return json.loads(self._meta_path.read_text())
+
+    def _write_meta(self, meta):
+        tmp = self._meta_path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(meta, indent=2))
+        os.replace(tmp, self._meta_path)
+
+    def _columns(self, table):
+        if self.asset == AssetEnum.INDEX:
+            return [table.c[c] for c in _INDEX_FIELDS]
+        return [c for c in table.c if c.key not in ('oid', 'updated_at')]
+
+    # ---- sync -------------------------------------
+    def _year_path(self, year):
+        return self.root.joinpath(f'{year}.parquet')
+
+    def _merge_year(self, year, frames, replace=False):
+        path = self._year_path(year)
+        if path.exists() and not replace:
+            frames = [pd.read_parquet(path), *frames]
+        data = pd.concat(frames, ignore_index=True).drop_duplicates(_KEYS, keep='last')
+        tmp = path.with_suffix('.tmp')
+        data.sort_values(['trade_dt', 'wind_code']).to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+
+    def sync(self, chunk_rows=500000, check_deletes=False):
+        """
+        从数据库同步 `updated_at` 晚于水位的数据, 同一 (wind_code, trade_dt) 以新数据为准
+
+        :param check_deletes: compare row counts of each year with database, and rebuild years with deleted rows.
+            It scans the whole source tables, so run it periodically instead of on every sync.
+
+        :return: number of rows synced
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        meta = self.read_meta()
+        n_rows = 0
+        for source in self.sources:
+            table = get_or_create_table(source)
+            watermark = meta['watermarks'].get(source)
+            query = sa.select([*self._columns(table), table.c.updated_at])
+            if watermark:
+                query = query.where(table.c.updated_at > pd.Timestamp(watermark) - self.overlap)
+
+            tic = time.time()
+            pending, new_mark = dict(), watermark and pd.Timestamp(watermark)
+            # rows of the same key are ordered by `updated_at`, so the latest one wins in `_merge_year`.
+            query = query.order_by(table.c.trade_dt, table.c.updated_at)
+            for frame in iter_frames(query, chunk_rows=chunk_rows, split_by='trade_dt'):
+                n_rows += frame.shape[0]
+                frame_mark = frame['updated_at'].max()
+                new_mark = frame_mark if new_mark is None else max(new_mark, frame_mark)
+                for year, group in frame.drop(columns='updated_at').groupby(frame['trade_dt'].dt.year):
+                    pending.setdefault(year, []).append(group)
+                # rows are ordered by date, so earlier years are complete.
+                for year in [y for y in pending if y < frame['trade_dt'].dt.year.max()]:
+                    self._merge_year(year, pending.pop(year))
+            for year, frames in pending.items():
+                self._merge_year(year, frames)
+
+            meta['watermarks'][source] = None if new_mark is None else pd.Timestamp(new_mark).isoformat()
+            logger.info(f'sync {source} into {self!r} in {time.time() - tic:.2f}s')
+
+        if check_deletes:
+            for year in self._shrunk_years():
+                self._rebuild_year(year, chunk_rows)
+
+        meta['synced_at'] = pd.Timestamp.now().isoformat()
+        self._write_meta(meta)
+        with self._lock:
+            self._fresh = (0, False)
+        return n_rows
+
+    def _shrunk_years(self):
+        """ years having fewer distinct (wind_code, trade_dt) in database than in local files """
+        db_counts = pd.Series(dtype=int)
+        with get_session() as session:
+            for source in self.sources:
+                table = get_or_create_table(source)
+                year = sa.extract('year', table.c.trade_dt)
+                rows = session.execute(
+                    sa.select([year, sa.func.count(sa.distinct(sa.tuple_(table.c.wind_code, table.c.trade_dt)))])
+                    .group_by(year)
+                ).fetchall()
+                db_counts = db_counts.add(pd.Series({int(y): n for y, n in rows}, dtype=int), fill_value=0)
+
+        years = []
+        for path in self.root.glob('*.parquet'):
+            local = pd.read_parquet(path, columns=['trade_dt']).shape[0]
+            if db_counts.get(int(path.stem), 0) < local:
+                years.append(int(path.stem))
+        return sorted(years)
+
+    def _rebuild_year(self, year, chunk_rows=500000):
+        """ read a whole year again, rows deleted in database are removed from local file """
+        tic = time.time()
+        frames = []
+        for source in self.sources:
+            table = get_or_create_table(source)
+            query = sa.select(self._columns(table)).where(
+                table.c.trade_dt.between(pd.Timestamp(year, 1, 1), pd.Timestamp(year, 12, 31))
+            ).order_by(table.c.trade_dt, table.c.updated_at)
+            frames.extend(iter_frames(query, chunk_rows=chunk_rows, split_by='trade_dt'))
+        if frames:
+            self._merge_year(year, frames, replace=True)
+        else:
+            self._year_path(year).unlink()
+        logger.info(f'rebuild {year} of {self!r} in {time.time() - tic:.2f}s')
+
+    def is_fresh(self):
+        """ 本地数据是否与数据库一致, 即各数据源的 `max(updated_at)` 不晚于水位, 结果缓存 `check_interval` 秒 """
+        with self._lock:
+            checked_at, fresh = self._fresh
+            if time.time() - checked_at < self.check_interval:
+                return fresh
+
+            watermarks = self.read_meta()['watermarks']
+            fresh = set(watermarks) == set(self.sources)
+            if fresh:
+                with get_session() as session:
+                    for source in self.sources:
+                        db_mark = session.execute(
+                            sa.select([sa.func.max(get_or_create_table(source).c.updated_at)])
+                        ).scalar()
+                        if db_mark is not None and (
+                                watermarks[source] is None or pd.Timestamp(db_mark) > pd.Timestamp(watermarks[source])):
+                            fresh = False
+                            break
+            self._fresh = (time.time(), fresh)
+            return fresh
+
+    # ---- read -------------------------------------
+    def read(self, start=None, end=None, code=None, fields=None, dates=None, asof=False):
+        """
+        读取本地行情, 参数同 `get_price`
+
+        :return: DataFrame sorted by trade_dt
+        """
+        if dates is not None:
+            lo, hi = sample_windows(dates)
+            if hi.empty:
+                return pd.DataFrame(columns=[*_KEYS, *(f for f in fields or () if f not in _KEYS)])
+            if not asof:
+                return self.read(hi[0], hi[-1], code, fields).loc[lambda df: df['trade_dt'].isin(hi)]
+
+            # windows are contiguous, every row in (lo[0], hi[-1]] falls in exactly one of them.
+            data = self.read(lo[0] + pd.Timedelta(days=1), hi[-1], code, fields)
+            pos = hi.values.searchsorted(data['trade_dt'].values, side='left')
+            data = data.assign(trade_dt=hi.values[pos])
+            # rows are sorted by date, the last one in each window is the as-of value.
+            return data.drop_duplicates(_KEYS, keep='last').reset_index(drop=True)
+
+        years = sorted(int(p.stem) for p in self.root.glob('*.parquet'))
+        if start is not None:
+            start = pd.Timestamp(start)
+            years = [y for y in years if y >= start.year]
+        if end is not None:
+            end = pd.Timestamp(end)
+            years = [y for y in years if y <= end.year]
+
+        filters = []
+        if start is not None:
+            filters.append(('trade_dt', '>=', start))
+        if end is not None:
+            filters.append(('trade_dt', '<=', end))
+        if code:
+            filters.append(('wind_code', '==', code))
+        columns = [*_KEYS, *(f for f in fields if f not in _KEYS)] if fields else None
+
+        frames = [
+            pd.read_parquet(self._year_path(y), columns=columns, filters=filters or None, memory_map=True)
+            for y in years
+        ]
+        if not frames:
+            return pd.DataFrame(columns=columns if columns else [])
+        return pd.concat(frames, ignore_index=True)
+
+
+@lru_cache()
+def get_price_store(asset: AssetEnum) -> PriceStore:
+    return PriceStore(asset)
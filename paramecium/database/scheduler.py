@@ -12,6 +12,7 @@ from ndscheduler.corescheduler import job as nd_job
 from ndscheduler.server import server as nd_server
 
 from ._postgres import create_all_table, upsert_data, bulk_insert, clean_duplicates
+from ._query_stats import profile_queries
 
 # sometimes the logger would be duplicates, so check and keep only one.
 logger = logging.getLogger()
@@ -41,6 +42,12 @@ class BaseJob(nd_job.JobBase):
             execution_id = uuid4()
         super().__init__(job_id, execution_id)
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # tag queries with job name, and report them when query stats is enabled.
+        if 'run' in cls.__dict__:
+            cls.run = profile_queries(lambda self: self.get_model_name())(cls.run)
+
     @classmethod
     def get_model_name(cls):
         return f'{cls.__module__:s}.{cls.__name__:s}'
@@ -62,7 +69,9 @@ class BaseJob(nd_job.JobBase):
     def insert_data(self, records, model, ukeys=None, msg=''):
         if isinstance(records, pd.DataFrame):
             records = records.filter(model.__dict__.keys(), axis=1).drop_duplicates(ignore_index=True)
-            records = (record.dropna().to_dict() for _, record in records.iterrows())
+            if ukeys:
+                # data frame without unique keys goes to `COPY` directly.
+                records = (record.dropna().to_dict() for _, record in records.iterrows())
 
         if ukeys:
             self.get_logger().info(f'Upsert data {msg}...')
@@ -71,6 +80,6 @@ class BaseJob(nd_job.JobBase):
             self.get_logger().info(f'Bulk insert data {msg}...')
             return bulk_insert(records, model)
 
-    def clean_duplicates(self, model, unique_cols):
+    def clean_duplicates(self, model, unique_cols, **kwargs):
         self.get_logger().debug(f'Clean duplicate data after bulk insert.')
-        return clean_duplicates(model, unique_cols)
+        return clean_duplicates(model, unique_cols, **kwargs)
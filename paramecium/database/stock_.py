@@ -8,49 +8,57 @@ TESTTESTTEST
 from functools import lru_cache
 
 import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as pg
 
 from .pg_models import stock
-from ._postgres import get_session
+from ._postgres import fetch_frame
 from ._third_party_api import get_tushare_data
-from ._tool import flat_1dim
-from ..interface import AbstractUniverse
+from ._universe import CachedUniverse
+from .membership import get_name_index
 
 
 @lru_cache()
-class StockUniverse(AbstractUniverse):
+class StockUniverse(CachedUniverse):
+    source_tables = ('stock_org_description', 'stock_org_previous_name')
+    dated_sources = {'stock_org_price': 'trade_dt'}
+
     def __init__(self, issue_month=12, delist_month=1, no_st=True, no_suspend=True):
         self.issue = issue_month * 31
         self.delist = delist_month * 31
         self.no_st = no_st
         self.no_suspend = no_suspend
 
-    @lru_cache(maxsize=2)
-    def get_instruments(self, trade_dt):
-        with get_session() as session:
-            query_desc = session.query(
-                stock.AShareDescription.wind_code,
-            ).filter(
-                stock.AShareDescription.list_dt < (trade_dt - pd.Timedelta(days=self.issue)),
-                stock.AShareDescription.delist_dt > (trade_dt + pd.Timedelta(days=self.delist)),
-            ).all()
-            query_trade = session.query(
-                stock.AShareEODPrice.wind_code
-            ).filter(
-                stock.AShareEODPrice.trade_dt == trade_dt,
-                stock.AShareEODPrice.trade_status == 0
-            ).all()
-            query_st = pd.DataFrame(
-                session.query(
-                    stock.ASharePreviousName.wind_code,
-                    stock.ASharePreviousName.sector_code
-                ).filter(
-                    stock.ASharePreviousName.entry_dt <= trade_dt,
-                    stock.ASharePreviousName.remove_dt >= trade_dt
-                ).all()
-            )
-            stock_dt = query_st.loc[query_st['new_name'].str.contains(r'ST|PT|退市'), 'wind_code']
+    def _init_args(self):
+        return self.issue // 31, self.delist // 31, self.no_st, self.no_suspend
+
+    def __str__(self):
+        return f"Stock(issue={self.issue}days, delist={self.delist}days, no_st={self.no_st}, no_suspend={self.no_suspend})"
+
+    def compute_range(self, dates):
+        desc = fetch_frame(sa.select([
+            stock.AShareDescription.wind_code, stock.AShareDescription.list_dt, stock.AShareDescription.delist_dt
+        ]))
+        values = dates.values[:, None]
+        listed = (
+                (desc['list_dt'].values[None, :] < values - pd.Timedelta(days=self.issue).to_timedelta64())
+                & (desc['delist_dt'].values[None, :] > values + pd.Timedelta(days=self.delist).to_timedelta64())
+        )
+        codes = pd.Index(desc['wind_code'])
+
+        if self.no_suspend:
+            model = stock.AShareEODPrice
+            suspended = fetch_frame(sa.select([model.trade_dt, model.wind_code]).where(sa.and_(
+                model.trade_dt == sa.any_(sa.literal([t.date() for t in dates], pg.ARRAY(sa.Date))),
+                model.trade_status == 0,
+            ))).loc[lambda df: df['wind_code'].isin(codes)]
+            listed[dates.get_indexer(suspended['trade_dt']), codes.get_indexer(suspended['wind_code'])] = False
 
-        return {*flat_1dim(query_desc)} - {*flat_1dim(query_trade)} - {*stock_dt}
+        universe = pd.DataFrame(listed, index=dates, columns=codes)
+        if self.no_st:
+            st = get_name_index().contains(dates, pattern=r'ST|PT|退市')
+            universe &= ~st.reindex(columns=universe.columns, fill_value=False)
+        return universe
 
 
 def get_derivative_indicator(trade_dt, codes=None, fields=None):
@@ -11,19 +11,14 @@ import pandas as pd
 import scipy.stats as sc_stats
 
 from . import const
-from .database import FactorDBTool, get_price, get_dates
+from .database import get_factor_io, get_panel, get_calendar
+from .database._query_stats import profile_queries
 from .interface import AbstractFactor
 from .utils import transformer as tf, price_stats as stats
 
 
 def _get_adj_price(dt, asset_type):
-    price = get_price(asset_type, dt, dt).set_index('wind_code')
-    if asset_type == const.AssetEnum.STOCK:
-        return (price['close_'] * price['adj_factor']).rename('adj_price')
-    elif asset_type == const.AssetEnum.CMF:
-        return (price['unit_nav'] * price['adj_factor']).rename('adj_price')
-    else:
-        raise KeyError("Unknown asset type.")
+    return get_panel(asset_type, dates=[dt]).iloc[0].dropna().rename('adj_price')
 
 
 def _cut_or_nan(val, q):
@@ -56,6 +51,11 @@ class AbstractFactorAnalyzer(metaclass=abc.ABCMeta):
     def name(self):
         return ""
 
+    def prepare(self, dates):
+        """ 测试开始前预读全部测试日期的数据, 之后 `get_factor` 等只是查找 """
+        if self.universe is not None:
+            self.universe.get_instruments_range(dates)
+
     @staticmethod
     def describe_stats(val):
         return pd.DataFrame({k: func(val) for k, func in {
@@ -83,8 +83,11 @@ class AbstractFactorAnalyzer(metaclass=abc.ABCMeta):
 
         return val.apply(_agg).T
 
+    @profile_queries(lambda self: self.name or self.__class__.__name__)
     def run(self, output, start_date, end_date=None, freq=const.FreqEnum.M, shift=1):
-        dates = [t for t in get_dates(freq) if start_date <= t <= (end_date if end_date else pd.Timestamp.now())]
+        dates = get_calendar().range(start_date, end_date if end_date else pd.Timestamp.now(), freq)
+
+        self.prepare(dates[:-shift])
 
         desc, ic, reg, grouped = dict(), dict(), dict(), dict()
 
@@ -202,7 +205,7 @@ class SingleFactorAnalyzer(AbstractFactorAnalyzer):
     def __init__(self, factor: 'AbstractFactor', transformers=(tf.OutlierMAD(), tf.ScaleNormalize()),
                  universe: 'AbstractUniverse' = None, ic_method='spearman', group_quantile=5):
         self.obj = factor
-        self.io = FactorDBTool(self.obj)
+        self.io = get_factor_io(self.obj)
 
         super().__init__(transformers, universe, ic_method, group_quantile)
 
@@ -215,11 +218,17 @@ class SingleFactorAnalyzer(AbstractFactorAnalyzer):
 
     @property
     def name(self):
-        return self.io.table.key
+        return self.io.key
+
+    def prepare(self, dates):
+        super().prepare(dates)
+        data = self.io.fetch_range(dates=dates)
+        self._factors = {dt: pd.DataFrame(columns=data.columns) for dt in dates}
+        self._factors.update({dt: df.droplevel('trade_dt') for dt, df in data.groupby(level='trade_dt')})
 
     @lru_cache(maxsize=4)
     def get_factor(self, dt):
-        val = self.io.fetch_snapshot(dt)
+        val = self._factors[dt] if dt in getattr(self, '_factors', ()) else self.io.fetch_snapshot(dt)
         if self.universe is not None:
             val = val.filter(self.universe.get_instruments(dt), axis=0)
         return val
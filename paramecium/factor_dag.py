@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+因子依赖图: 因子通过 `depends` 声明上游因子, 按拓扑层级计算, 同一层的因子并行.
+共用的上游因子只计算一次, 上游失败时下游跳过, 不会在过期的输入上计算.
+"""
+__all__ = ['FactorDAG']
+
+import importlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from . import const
+from .database import get_factor_io
+from .database._postgres import get_session
+from .database.pg_models import monitors
+from .factor_pool.fund_stats import clear_ret_cache
+
+logger = logging.getLogger(__name__)
+
+
+class _Node(object):
+
+    def __init__(self, factor, freq):
+        self.factor = factor
+        self.io = get_factor_io(factor)
+        self.freq = freq
+        self.upstream = [get_factor_io(f).key for f in factor.depends]
+
+    @property
+    def key(self):
+        return self.io.key
+
+
+class FactorDAG(object):
+    """
+    :param factors: list of (factor, freq), upstream factors not listed are computed at the freq of their first user
+    """
+
+    def __init__(self, factors):
+        self.nodes = dict()
+        for factor, freq in factors:
+            self._add(factor, const.FreqEnum[freq] if isinstance(freq, str) else freq)
+
+    def _add(self, factor, freq):
+        key = get_factor_io(factor).key
+        if key not in self.nodes:
+            self.nodes[key] = _Node(factor, freq)
+            for upstream in factor.depends:
+                self._add(upstream, freq)
+        return key
+
+    @classmethod
+    def from_monitor(cls):
+        """ 监控列表 `monitor_factor_list` 中有效的因子 """
+        with get_session() as ss:
+            factor_list = ss.query(monitors.FundFactorList).filter(monitors.FundFactorList.status == 1).all()
+
+        factors = []
+        for instance in factor_list:
+            module_path, cls_name = instance.module_path.rsplit('.', maxsplit=1)
+            factor = getattr(importlib.import_module(module_path), cls_name)(**instance.params)
+            factors.append((factor, instance.calc_freq))
+        return cls(factors)
+
+    def levels(self):
+        """
+        拓扑层级, 每层的因子只依赖之前层级的因子
+
+        :return: list of list of key
+        """
+        remain = {key: {*node.upstream} for key, node in self.nodes.items()}
+        levels = []
+        while remain:
+            level = sorted(key for key, upstream in remain.items() if not upstream & remain.keys())
+            if not level:
+                raise ValueError(f'circular dependency among {", ".join(sorted(remain))}')
+            levels.append(level)
+            for key in level:
+                remain.pop(key)
+        return levels
+
+    def _run_node(self, node, upstream_dates, batch_size):
+        dates = node.io.stale_dates(freq=node.freq)
+        if upstream_dates:
+            # dates recomputed upstream are stale for this factor as well.
+            calc_dates = pd.DatetimeIndex([*node.io.get_calc_dates(None, None, node.freq)])
+            dates = dates.union(calc_dates.intersection(pd.DatetimeIndex(upstream_dates)))
+
+        node.io.logger.info(f'{dates.size} dates to compute')
+        for i in range(0, dates.size, batch_size):
+            node.io.localized_snapshots(dates[i:i + batch_size])
+        return dates
+
+    def run(self, n_threads=4, batch_size=12):
+        """
+        按层级计算过期日期(见 `localized_stale`), 同一层的因子用线程并行
+
+        :param n_threads: max factors computed at the same time
+        :param batch_size: dates of each write
+        :return: dict of key -> status, one of 'done', 'failed' and 'skipped'
+        """
+        # watermarks are read from database directly, panels cached before this run must not be reused.
+        clear_ret_cache()
+        status, computed = dict(), dict()
+        for level in self.levels():
+            tasks = dict()
+            with ThreadPoolExecutor(n_threads) as pool:
+                for key in level:
+                    node = self.nodes[key]
+                    broken = [k for k in node.upstream if status[k] != 'done']
+                    if broken:
+                        logger.warning(f'skip {key} since upstream {", ".join(broken)} not done')
+                        status[key] = 'skipped'
+                        continue
+                    upstream_dates = {t for k in node.upstream for t in computed[k]}
+                    tasks[key] = pool.submit(self._run_node, node, upstream_dates, batch_size)
+
+                for key, task in tasks.items():
+                    try:
+                        computed[key] = task.result()
+                        status[key] = 'done'
+                    except Exception:
+                        logger.exception(f'fail to compute {key}')
+                        status[key] = 'failed'
+                    else:
+                        logger.info(f'{key} done, {computed[key].size} dates computed')
+        return status
@@ -3,8 +3,9 @@
 @Time: 2020/6/9 14:27
 @Author: Sue Zhu
 """
-__all__ = ['FundPerform', 'FundRegFF3', 'FundRegBond5', 'AllocationPureBond']
+__all__ = ['FundPerform', 'FundRegFF3', 'FundRegBond5', 'AllocationPureBond', 'clear_ret_cache']
 
+import warnings
 from functools import partial
 
 import numpy as np
@@ -13,12 +14,22 @@ import scipy.stats as sc_stats
 from scipy.optimize import minimize
 
 from .. import const
+from ..configuration import get_option
 from ..const import AssetEnum
-from ..database import get_dates, get_price, get_index_ff3, get_index_bond5, FactorDBTool
+from ..database import get_dates, get_calendar, get_panel, get_index_ff3, get_index_bond5, get_factor_io
+from ..database._memo import source_token
 from ..database.fund_ import FundUniverse
-from ..exc import DataExistError
 from ..interface import AbstractFactor
 from ..utils import price_stats as p_stats, transformer as tf
+from ..utils.df_tool import FrameLRU
+
+# 各收益率因子共用的面板缓存: 同一频率同一日期的净值只读取最长窗口的一份, 短窗口从中截取.
+# 键中包含数据源版本, 净值或持仓重写后旧的面板不再命中.
+_panel_cache = FrameLRU(int(get_option('cache', 'return_panel_mb', fallback=512)) * 2 ** 20)
+
+
+def clear_ret_cache():
+    _panel_cache.clear()
 
 
 class _RetFactor(AbstractFactor):
@@ -28,6 +39,8 @@ class _RetFactor(AbstractFactor):
     asset_type = const.AssetEnum.CMF
     std_limit = 1e-8  # 去除净值为一条线的情况
     start_date = pd.Timestamp('2009-12-31')
+    inputs = {'mf_org_nav': 'trade_dt', 'mf_org_portfolio': 'end_date'}
+    panel_win = 156  # 共用净值面板的长度(期数), 窗口更长的因子单独读取
 
     def __init__(self, bk_win, freq='W'):
         self.freq = const.FreqEnum[freq]
@@ -49,16 +62,42 @@ class _RetFactor(AbstractFactor):
             size_=0  # 初始条件较为宽松，防止因子覆盖率过低
         )
 
+    def input_window(self, dt):
+        return get_calendar().range(end=dt, freq=self.freq)[-self.bk_win - 1:][0], dt
+
+    def _get_price_pvt(self, dt, codes):
+        """
+        净值面板, 行为 `panel_win` 期的日期, 缓存中缺少的代码补读后并入.
+        多读一个采样日, 使用到的每一行的as-of区间都以前一个采样日为下界.
+        """
+        n_dates = max(_RetFactor.panel_win, self.bk_win) + 2
+        key = ('price', self.asset_type, self.freq, n_dates, dt, source_token(_RetFactor.inputs))
+        price_pvt = _panel_cache.get(key)
+        if price_pvt is None:
+            dates = get_calendar().range(end=dt, freq=self.freq)[-n_dates:]
+            price_pvt = get_panel(self.asset_type, dates=dates, codes=codes, asof=True)
+        else:
+            missing = codes.difference(price_pvt.columns)
+            if missing.empty:
+                return price_pvt
+            new = get_panel(self.asset_type, dates=price_pvt.index, codes=missing, asof=True)
+            price_pvt = pd.concat([price_pvt, new], axis=1)
+        return _panel_cache.put(key, price_pvt)
+
     def _get_ret_pvt(self, dt):
-        dates = [t for t in get_dates(self.freq) if t <= dt]
-        funds = self.universe.get_instruments(dt)
-
-        price = get_price(self.asset_type, start=dates[-self.bk_win - 1], end=dt)
-        price['adj_nav'] = price['unit_nav'] * price['adj_factor']
-        price_pvt = price.pivot('trade_dt', 'wind_code', 'adj_nav').filter(dates, axis=0).filter(funds, axis=1)
-        ret = price_pvt.pct_change(1, limit=1).iloc[1:].where(lambda df: df.ne(0))
-        ret = ret.dropna(thresh=round(self.bk_win * 0.8), axis=1)
-        ret = ret.loc[:, ret.std().gt(self.std_limit) & ret.abs().max().le(1.1 ** (250 / self.freq.value) - 1)]
+        """ 清洗后的收益率面板, 按 (频率, 窗口, universe参数, 日期) 缓存, 不要原地修改 """
+        key = ('ret', self.asset_type, self.freq, self.bk_win, self.universe._init_args(), dt,
+               source_token(_RetFactor.inputs))
+        ret = _panel_cache.get(key)
+        if ret is None:
+            funds = pd.Index(sorted(self.universe.get_instruments(dt)))
+            price_pvt = self._get_price_pvt(dt, funds).iloc[-self.bk_win - 1:]
+            price_pvt = price_pvt.reindex(columns=funds).dropna(how='all')
+            filled = price_pvt.ffill(limit=1)  # same as `pct_change(1, limit=1)` of pandas<2
+            ret = filled.div(filled.shift(1)).sub(1).iloc[1:].where(lambda df: df.ne(0))
+            ret = ret.dropna(thresh=round(self.bk_win * 0.8), axis=1)
+            ret = ret.loc[:, ret.std().gt(self.std_limit) & ret.abs().max().le(1.1 ** (250 / self.freq.value) - 1)]
+            ret = _panel_cache.put(key, ret)
         return ret
 
 
@@ -81,8 +120,8 @@ class FundPerform(_RetFactor):
 
     def __init__(self, bk_win, freq='W'):
         super().__init__(bk_win=bk_win, freq=freq)
-        _rf = 0
-        _alpha = 0.05
+        _rf = self.rf = 0
+        _alpha = self.alpha = 0.05
         self.funcs = dict(
             ann_ret=partial(p_stats.annual_returns, mul=self.freq.value),
             ann_vol=partial(p_stats.annual_volatility, mul=self.freq.value),
@@ -114,11 +153,122 @@ class FundPerform(_RetFactor):
         factor = factor.where(~np.isinf(factor))
         return factor
 
+    def compute_range(self, dates, chunk_size=2 ** 24):
+        """
+        一次计算多个日期, 结果与逐日 `compute` 一致.
+        均值/波动/偏度/峰度/下行风险由累积和相减得到窗口矩, 最大回撤与VaR/CVaR在按块展开的窗口上计算.
+        窗口内有全部成分都没有净值的采样日时, 该日期改用 `compute`.
+
+        :param dates: list of pd.Timestamp
+        :param chunk_size: max number of elements of the expanded windows
+        :return: dict of date -> DataFrame
+        """
+        dates = pd.DatetimeIndex(dates).sort_values()
+        if dates.empty:
+            return dict()
+        cal = get_calendar().range(end=dates[-1], freq=self.freq)
+        end = cal.searchsorted(dates, side='right') - 1  # last sample date of each window
+        lo = max(end.min() - self.bk_win - 1, 0)  # one more leading date, see `_get_price_pvt`
+        member = self.universe.get_instruments_range(dates)
+        codes = member.columns[member.any(axis=0).values].sort_values()
+        member = member.reindex(columns=codes).values
+
+        price = get_panel(self.asset_type, dates=cal[lo:end.max() + 1], codes=codes, asof=True)
+        filled = price.ffill(limit=1).values
+        ret = np.full(filled.shape, np.nan)
+        ret[1:] = filled[1:] / filled[:-1] - 1
+        ret[ret == 0] = np.nan
+        # the first return of a window can not be bridged over a missing price before the window.
+        first_ok = np.vstack([np.zeros((1, codes.size), dtype=bool), ~np.isnan(price.values[:-1])])
+
+        end = end - lo
+        start = np.maximum(end - self.bk_win + 1, 1)
+        n_row = (end - start + 1)[:, None]
+        first = np.where(first_ok[start], ret[start], np.nan)
+
+        def _window_sum(values):
+            """ sum of `values` (nan as 0) over each window except its first row, which is added from `first` """
+            values = np.nan_to_num(values)
+            cum = np.vstack([np.zeros((1, codes.size)), np.cumsum(values, axis=0)])
+            return cum[end + 1] - cum[start] - values[start]
+
+        # empty windows and all-nan columns give nan, and are dropped by `valid` below.
+        with warnings.catch_warnings(), np.errstate(divide='ignore', invalid='ignore'):
+            warnings.simplefilter('ignore', RuntimeWarning)
+            shift = np.nan_to_num(np.nanmean(ret, axis=0))
+            x, x0 = ret - shift, first - shift
+            n = _window_sum(~np.isnan(ret)) + ~np.isnan(first)
+            s1, s2, s3, s4 = (_window_sum(x ** k) + np.nan_to_num(x0 ** k) for k in range(1, 5))
+            mu = s1 / n
+            m2 = s2 / n - mu ** 2
+            m3 = s3 / n - 3 * mu * s2 / n + 2 * mu ** 3
+            m4 = s4 / n - 4 * mu * s3 / n + 6 * mu ** 2 * s2 / n - 3 * mu ** 4
+            std = np.sqrt(np.maximum(m2, 0) * n / (n - 1))
+
+            mul = self.freq.value
+            log_ret = _window_sum(np.log1p(ret)) + np.nan_to_num(np.log1p(first))
+            ann_ret = np.exp(log_ret * mul / n_row) - 1
+            down = np.minimum(np.nan_to_num(ret) - self.rf, 0)
+            down0 = np.minimum(np.nan_to_num(first) - self.rf, 0)
+            d1, d2 = _window_sum(down) + down0, _window_sum(down ** 2) + down0 ** 2
+            down_side = np.sqrt(np.maximum(d2 - d1 ** 2 / n_row, 0) / (n_row - 1) * mul)
+
+            max_dd, var, c_var, abs_max = (np.full(n.shape, np.nan) for _ in range(4))
+            offset = np.arange(self.bk_win)
+            step = max(chunk_size // (self.bk_win * max(codes.size, 1)), 1)
+            for i in range(0, dates.size, step):
+                rows = (start[i:i + step, None] + offset[None, :]).T  # window x date
+                in_win = (rows <= end[None, i:i + step])[..., None]
+                windows = np.where(in_win, ret[np.minimum(rows, ret.shape[0] - 1)], np.nan)
+                windows[0] = first[i:i + step]
+                max_dd[i:i + step] = p_stats.max_draw_down(windows)
+                var[i:i + step] = p_stats.value_at_risk(windows, alpha=self.alpha)
+                c_var[i:i + step] = p_stats.conditional_var(windows, alpha=self.alpha)
+                abs_max[i:i + step] = np.nanmax(np.abs(windows), axis=0)
+
+            def _ratio(a, b):
+                return np.nan_to_num(a / b, nan=np.nan, posinf=np.nan, neginf=np.nan)
+
+            # same filters as `_get_ret_pvt`
+            valid = (member & (n >= round(self.bk_win * 0.8)) & (std > self.std_limit)
+                     & (abs_max <= 1.1 ** (250 / self.freq.value) - 1))
+            ann_ret_rf = np.exp((_window_sum(np.log1p(ret - self.rf)) + np.nan_to_num(np.log1p(first - self.rf)))
+                                * mul / n_row) - 1
+            stats = dict(
+                ann_ret=ann_ret,
+                ann_vol=std * np.sqrt(mul),
+                skewness=m3 / m2 ** 1.5,
+                kurtosis=m4 / m2 ** 2 - 3,
+                max_dd=max_dd,
+                down_side_risk=down_side,
+                var=var,
+                c_var=c_var,
+                sharpe=_ratio(ann_ret_rf, std * np.sqrt(mul)),
+                sortino=_ratio(ann_ret_rf, down_side),
+                calmar=_ratio(-ann_ret_rf, max_dd),
+            )
+
+        # `_get_ret_pvt` drops sample dates without price of any member and bridges returns over them,
+        # which changes the window, so these dates are computed one by one.
+        empty = np.vstack([np.zeros((1, dates.size), dtype=int), np.cumsum(
+            (~np.isnan(price.values)).astype(int) @ member.T.astype(int) == 0, axis=0)])
+        gapped = (empty[end + 1, np.arange(dates.size)] - empty[start - 1, np.arange(dates.size)]) > 0
+
+        result = dict()
+        for i, dt in enumerate(dates):
+            if gapped[i]:
+                result[dt] = self.compute(dt)
+                continue
+            factor = pd.DataFrame({k: v[i, valid[i]] for k, v in stats.items()}, index=codes[valid[i]])
+            result[dt] = factor.where(~np.isinf(factor))
+        return result
+
 
 class _Reg(_RetFactor):
     """"
     回归因子
     """
+    inputs = {**_RetFactor.inputs, 'index_org_price': 'trade_dt', 'index_derivative_price': 'trade_dt'}
 
     def __init__(self, bk_win, freq='W', half_life=0):
         self.index_ret = self.get_index_ret()
@@ -190,13 +340,17 @@ class AllocationPureBond(AbstractFactor):
     def __init__(self, idx_win, bk_win, freq='W'):
         self._raw = FundRegBond5(bk_win, freq)
         self.universe = FundUniverse(include_=('2001010301000000', '2001010303000000'), size_=1)
-        self._io = FactorDBTool(self._raw)
+        self._io = get_factor_io(self._raw)
         self.idx_win = idx_win
 
     @property
     def index_ret(self):
         return self._raw.index_ret
 
+    @property
+    def depends(self):
+        return self._raw,
+
     @property
     def field_types(self):
         return {'mix_factor': float}
@@ -206,11 +360,6 @@ class AllocationPureBond(AbstractFactor):
         return f'pure_bond_allocation{self._raw.name.split("_")[-1]}_{self.idx_win}'
 
     def compute(self, dt):
-        try:
-            self._io.localized_snapshot(dt, if_exist=0)
-        except DataExistError:
-            pass
-
         raw_factor = self._io.fetch_snapshot(dt).filter(self.universe.get_instruments(dt), axis=0)
         for trans in (tf.OutlierMAD(), tf.ScaleNormalize()):
             raw_factor.loc[:] = trans.fit_transform(raw_factor.values)
@@ -8,7 +8,8 @@ from dataclasses import dataclass
 
 import pandas as pd
 from paramecium.const import AssetEnum
-from paramecium.database.comment import get_price, get_dates
+from paramecium.database.comment import get_dates
+from paramecium.database.panel import get_panel
 import abc
 
 
@@ -58,8 +59,5 @@ class FastBackTester(metaclass=abc.ABCMeta):
         return NotImplementedError
 
     def get_bar_data(self, dt):
-        # If need local data, change this.
-        price_data = get_price(self.asset, dt, dt).rename(
-            columns={'adj_nav': self.deal_price}
-        ).set_index('wind_code')
-        return price_data[self.deal_price].mul(price_data.get('adj_factor', 1), fill_value=1)
+        field = None if self.deal_price == 'close' else self.deal_price
+        return get_panel(self.asset, field=field, dates=[dt]).iloc[0].dropna()
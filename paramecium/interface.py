@@ -34,10 +34,23 @@ class AbstractUniverse(metaclass=abc.ABCMeta):
     def get_instruments(self, dt):
         return NotImplementedError
 
+    def get_instruments_range(self, dates):
+        """
+        多个日期的成分, 默认逐日调用 `get_instruments`
+
+        :param dates: array of dates
+        :return: DataFrame of bool, index is sorted dates and columns are codes
+        """
+        dates = pd.DatetimeIndex(dates).unique().sort_values()
+        members = [self.get_instruments(dt) for dt in dates]
+        codes = sorted(set().union(*members))
+        return pd.DataFrame([[c in m for c in codes] for m in members], index=dates, columns=codes, dtype=bool)
+
 
 class AbstractFactor(metaclass=abc.ABCMeta):
     asset_type: AssetEnum = None
     start_date = pd.Timestamp.min
+    inputs = dict()  # source table -> date column, dates are recomputed when sources change in `input_window`
 
     def __str__(self):
         return self.__class__.__name__
@@ -58,6 +71,28 @@ class AbstractFactor(metaclass=abc.ABCMeta):
     def compute(self, dt):
         return pd.DataFrame()
 
+    def compute_range(self, dates):
+        """
+        计算多个日期的因子, 默认逐日调用 `compute`, 子类可一次计算整段时间序列
+
+        :param dates: list of pd.Timestamp
+        :return: dict of date -> DataFrame, same as `compute`
+        """
+        return {dt: self.compute(dt) for dt in dates}
+
+    @property
+    def depends(self):
+        """ 上游因子, 由 `FactorDAG` 先于本因子计算 """
+        return ()
+
+    def input_window(self, dt):
+        """
+        计算 `dt` 所用数据源的日期区间
+
+        :return: tuple of (start, end)
+        """
+        return dt, dt
+
 
 class AbstractFactorIO(metaclass=abc.ABCMeta):
 
@@ -101,6 +136,46 @@ class AbstractFactorIO(metaclass=abc.ABCMeta):
         """
         return ()
 
-    def localized_time_series(self, start=None, end=None, freq=FreqEnum.M, if_exist=1):
-        for t in self.get_calc_dates(start, end, freq):
+    def fetch_range(self, start=None, end=None, dates=None, fields=None, as_panel=False):
+        """
+        读取多个日期的截面数据, 默认逐日调用 `fetch_snapshot`
+
+        :param start: pd.Timestamp, first date
+        :param end: pd.Timestamp, last date
+        :param dates: only these dates in [start, end]; required by the default implementation
+        :param fields: columns to read, default all fields of factor
+        :param as_panel: if True, return dict of field -> DataFrame (trade_dt x wind_code)
+        :return: DataFrame with MultiIndex (trade_dt, wind_code), or dict of panels
+        """
+        if dates is None:
+            raise ValueError(f'{self.__class__.__name__} requires `dates` to fetch a range.')
+        dates = pd.DatetimeIndex(dates)
+        if start is not None:
+            dates = dates[dates >= pd.Timestamp(start)]
+        if end is not None:
+            dates = dates[dates <= pd.Timestamp(end)]
+        fields = [*(fields or self._factor.field_types.keys())]
+        frames = {dt: self.fetch_snapshot(dt).filter(fields, axis=1) for dt in dates}
+        data = pd.concat(frames, names=['trade_dt', 'wind_code']) if frames else pd.DataFrame(
+            columns=fields, index=pd.MultiIndex.from_arrays([[], []], names=['trade_dt', 'wind_code']))
+        return self.to_panels(data) if as_panel else data
+
+    @staticmethod
+    def to_panels(data):
+        """ long frame with MultiIndex (trade_dt, wind_code) -> dict of field -> DataFrame (trade_dt x wind_code) """
+        return {field: data[field].unstack('wind_code') for field in data.columns}
+
+    def localized_snapshots(self, dates, if_exist=1):
+        """
+        计算并保存多个日期的截面数据, 默认逐日调用 `localized_snapshot`
+
+        :param dates: list of pd.Timestamp
+        :param if_exist: see `localized_snapshot`
+        """
+        for t in dates:
             self.localized_snapshot(t, if_exist)
+
+    def localized_time_series(self, start=None, end=None, freq=FreqEnum.M, if_exist=1, batch_size=12):
+        dates = [*self.get_calc_dates(start, end, freq)]
+        for i in range(0, len(dates), batch_size):
+            self.localized_snapshots(dates[i:i + batch_size], if_exist)
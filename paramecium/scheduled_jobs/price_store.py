@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""
+本地行情库的定时同步任务
+"""
+from ._base import *
+from ..const import AssetEnum
+from ..database.price_store import get_price_store
+
+
+class PriceStoreSync(BaseJob):
+    """
+    增量同步本地行情库
+    """
+    meta_args = (
+        {'type': 'string', 'description': 'asset value in `stock`, `mf` and `index`, default all'},
+        {'type': 'boolean', 'description': 'rebuild years with rows deleted in database, full scan, default false'},
+    )
+    meta_args_example = '["stock", false]'
+
+    def run(self, asset=None, check_deletes=False, *args, **kwargs):
+        for asset_ in ([AssetEnum(asset)] if asset else AssetEnum):
+            n_rows = get_price_store(asset_).sync(check_deletes=bool(check_deletes))
+            self.get_logger().info(f'{n_rows} rows synced into {asset_.name} price store.')
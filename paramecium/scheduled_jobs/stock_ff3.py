@@ -10,7 +10,7 @@ import sqlalchemy as sa
 
 from ._base import *
 from ..const import FreqEnum, AssetEnum
-from ..database import get_last_td, get_dates, FactorDBTool, get_price
+from ..database import get_last_td, get_calendar, get_factor_io, get_price, iter_price
 from ..database.pg_models import index
 from ..factor_pool import stock_classic
 
@@ -27,7 +27,7 @@ class StockFF3Factor(BaseJob):
     def __init__(self, job_id=None, execution_id=None):
         super().__init__(job_id, execution_id)
         self.ff3 = stock_classic.FamaFrench()
-        self.io = FactorDBTool(self.ff3)
+        self.io = get_factor_io(self.ff3)
         self.codes = [f'{self.prefix}{n}' for n in (''.join(m) for m in product('smb', 'gnv'))]
         self.names = [f'{sn}盘{gn}指数' for sn, gn in product('小中大', ('成长', '平衡', '价值'))]
 
@@ -74,7 +74,8 @@ class StockFF3Factor(BaseJob):
                     index.DerivativePrice.trade_dt > real_start
                 ).delete(synchronize_session='fetch')
 
-        month_end = max((t for t in get_dates(FreqEnum.M) if t <= real_start))
+        calendar = get_calendar()
+        month_end = calendar.prev(real_start, FreqEnum.M)
         if real_start == month_end:
             self.io.localized_snapshot(month_end, if_exist=1)
         factor_val = self.io.fetch_snapshot(month_end)
@@ -92,10 +93,15 @@ class StockFF3Factor(BaseJob):
                 columns=['benchmark_code', 'close_']
             ).set_index('benchmark_code').squeeze()
 
-        dates = (t for t in get_dates(FreqEnum.D) if real_start < t <= pd.Timestamp(end if end else get_last_td()))
+        end = pd.Timestamp(end)
+        dates = calendar.range(real_start + pd.Timedelta(days=1), end)
+        closes = self.iter_stock_close(real_start + pd.Timedelta(days=1), end)
+        next_dt, next_close = next(closes, (None, None))
         for dt in dates:
             self.get_logger().debug(f'run at {dt:%Y-%m-%d}.')
-            cur_close = self.get_stock_close(dt)
+            while next_dt is not None and next_dt < dt:
+                next_dt, next_close = next(closes, (None, None))
+            cur_close = next_close if next_dt == dt else pd.Series(dtype=float)
             factor = factor_val.assign(ret=cur_close.div(stock_close) - 1)
             cum_ret = factor.groupby('label').apply(lambda df: df['ret'].dot(df['capt']) / df['capt'].sum())
             nav = ff3_close.mul(cum_ret.rename(index=lambda k: f'{self.prefix}{k.lower()}').add(1)).round(6)
@@ -104,7 +110,7 @@ class StockFF3Factor(BaseJob):
                 model=index.DerivativePrice, msg=f'{dt:%Y-%m-%d}'
             )
 
-            if dt in get_dates(FreqEnum.M):
+            if calendar.is_period_end(dt, FreqEnum.M):
                 self.get_logger().debug(f'localized factor and close at {dt:%Y-%m-%d}.')
                 month_end = dt
                 self.io.localized_snapshot(dt, if_exist=1)
@@ -116,3 +122,11 @@ class StockFF3Factor(BaseJob):
     def get_stock_close(dt):
         price = get_price(AssetEnum.STOCK, start=dt, end=dt).set_index('wind_code')
         return price['close_'].mul(price['adj_factor'])
+
+    @staticmethod
+    def iter_stock_close(start, end):
+        """ 区间内逐日的后复权收盘价, 一次查询分块读取 """
+        for chunk in iter_price(AssetEnum.STOCK, start=start, end=end, fields=('close_', 'adj_factor')):
+            for dt, price in chunk.groupby('trade_dt', sort=True):
+                price = price.set_index('wind_code')
+                yield dt, price['close_'].mul(price['adj_factor'])
@@ -7,6 +7,8 @@ Usage:
 """
 import abc
 
+from ..database.calendar_ import get_calendar
+
 
 class AbstractDataProxy(metaclass=abc.ABCMeta):
 
@@ -14,9 +16,17 @@ class AbstractDataProxy(metaclass=abc.ABCMeta):
     def get_trade_dates(self, freq, exchange='SSE'):
         pass
 
-    @abc.abstractmethod
     def get_date_offset(self, base, n, freq, backward=True, exchange='SSE'):
-        pass
+        """
+        以不晚于 `base` 的最后一个交易日为基准, 偏移 `n` 个 `freq` 交易日
+
+        :param backward: if True, move to earlier dates
+        :param exchange: only SSE calendar is available
+        :return: pd.Timestamp, NaT if out of calendar
+        """
+        if exchange != 'SSE':
+            raise NotImplementedError(f'calendar of {exchange} is not available.')
+        return get_calendar().offset(base, -n if backward else n, freq)
 
     @abc.abstractmethod
     def get_interest_rate(self, rate_type):
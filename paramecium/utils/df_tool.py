@@ -3,6 +3,8 @@
 @Time: 2020/6/7 10:21
 @Author: Sue Zhu
 """
+import threading
+from collections import OrderedDict
 from functools import wraps
 
 
@@ -13,3 +15,56 @@ def df2records(func):
         return [record.dropna().to_dict() for _, record in raw_data.iterrows()]
 
     return wrapper
+
+
+class FrameLRU(object):
+    """
+    按内存大小淘汰的LRU缓存, 值为 DataFrame, 超过 `max_bytes` 时淘汰最久未使用的项.
+    取出的 DataFrame 与缓存共用内存, 不要原地修改.
+
+    :param max_bytes: int
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key][0]
+
+    def put(self, key, frame):
+        size = int(frame.memory_usage(index=True).sum())
+        with self._lock:
+            self.pop(key)
+            if size > self.max_bytes:
+                return frame
+            self._data[key] = (frame, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.nbytes -= evicted
+        return frame
+
+    def pop(self, key):
+        with self._lock:
+            if key in self._data:
+                frame, size = self._data.pop(key)
+                self.nbytes -= size
+                return frame
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+`FundPerform.compute_range` 与逐日 `compute` 的一致性, 数据库相关函数均替换为内存数据
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from paramecium.factor_pool import fund_stats as fs
+from paramecium.interface import AbstractUniverse
+
+WEEKS = pd.date_range('2015-01-02', periods=240, freq='W-FRI')
+CODES = [f'{i:06d}.OF' for i in range(40)]
+
+
+class _Calendar(object):
+
+    def range(self, start=None, end=None, freq=None):
+        return WEEKS[WEEKS <= pd.Timestamp(end)]
+
+
+class _Universe(AbstractUniverse):
+
+    def get_instruments(self, dt):
+        return {c for i, c in enumerate(CODES) if (i + dt.day) % 7}
+
+    def _init_args(self):
+        return ()
+
+
+def _nav(gap_rows=()):
+    rng = np.random.default_rng(0)
+    ret = rng.standard_t(4, (WEEKS.size, len(CODES))) * 0.01
+    ret[rng.random(ret.shape) < 0.05] = 0
+    nav = np.cumprod(1 + ret, axis=0)
+    nav[rng.random(nav.shape) < 0.04] = np.nan
+    nav[:40, :8] = np.nan  # not issued yet
+    nav[:, 20] = 1.0  # flat
+    nav[list(gap_rows)] = np.nan  # no member has price
+    return pd.DataFrame(nav, index=WEEKS, columns=CODES)
+
+
+@pytest.fixture
+def factor(monkeypatch):
+    def _factory(nav):
+        monkeypatch.setattr(fs, 'get_calendar', lambda: _Calendar())
+        monkeypatch.setattr(fs, 'get_panel', lambda asset, dates=None, codes=None, asof=False: nav.reindex(
+            index=pd.DatetimeIndex(dates), columns=pd.Index(codes)))
+        monkeypatch.setattr(fs, 'source_token', lambda tables: '')
+        monkeypatch.setattr(fs, 'FundUniverse', lambda **kwargs: _Universe())
+        fs.clear_ret_cache()
+        return fs.FundPerform(52)
+
+    yield _factory
+    fs.clear_ret_cache()
+
+
+@pytest.mark.parametrize('gap_rows', [(), (70, 71, 130, 180)])
+def test_compute_range_matches_compute(factor, gap_rows):
+    perform = factor(_nav(gap_rows))
+    dates = WEEKS[[1, 30, 53, 60, 72, 100, 120, 131, 150, 185, 200, 239]]
+    result = perform.compute_range(dates, chunk_size=5000)
+    assert [*result.keys()] == [*dates]
+    for dt in dates:
+        expected = perform.compute(dt).astype(float)
+        pd.testing.assert_index_equal(result[dt].index, expected.index)
+        pd.testing.assert_frame_equal(result[dt], expected, rtol=1e-8, atol=1e-10, check_dtype=False)
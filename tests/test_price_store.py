@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+采样日as-of区间及本地行情读取的边界情况
+"""
+import pandas as pd
+
+from paramecium.const import AssetEnum
+from paramecium.database import panel
+from paramecium.database.price_store import PriceStore, sample_windows
+
+
+def test_sample_windows():
+    lo, hi = sample_windows(pd.DatetimeIndex(['2020-01-10', '2020-01-03', '2020-01-17']))
+    assert [*hi] == [*pd.DatetimeIndex(['2020-01-03', '2020-01-10', '2020-01-17'])]
+    assert [*lo] == [*pd.DatetimeIndex(['2019-12-27', '2020-01-03', '2020-01-10'])]
+
+
+def test_sample_windows_empty():
+    lo, hi = sample_windows([])
+    assert lo.empty and hi.empty
+
+
+def test_read_empty_dates(tmp_path, monkeypatch):
+    monkeypatch.setattr('pathlib.Path.home', lambda: tmp_path)
+    store = PriceStore(AssetEnum.CMF)
+    for asof in (True, False):
+        data = store.read(dates=[], fields=['unit_nav'], asof=asof)
+        assert data.empty and [*data.columns] == ['wind_code', 'trade_dt', 'unit_nav']
+
+
+def test_panel_empty_dates(monkeypatch):
+    monkeypatch.setattr(panel, 'source_token', lambda tables: '')
+    panel.clear_panel_cache()
+    frame = panel.get_panel(AssetEnum.CMF, dates=pd.DatetimeIndex([]), codes=['000001.OF'], asof=True)
+    assert frame.shape == (0, 1)